@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+from utils import connect, batch
+from tools import search, index
+
+def main():
+    # Step 1: Get shared environment
+    conn, cursor, db_meta = connect.get_env()
+
+    # Step 2: Run a few searches so the advisor has usage to work from
+    tool_handlers = {
+        "search": search.handle,
+        "index": index.handle
+    }
+
+    search_package = {
+        "batch_1": {
+            "process_1": {
+                "search": {
+                    "Tracking": {
+                        "state_filed": {"and": [{"equals": "TX"}]},
+                        "entity_type": {"and": [{"equals": "Lead"}]}
+                    }
+                }
+            }
+        }
+    }
+    for _ in range(3):
+        batch.handle_batch(search_package, conn, cursor, db_meta, tool_handlers)
+
+    # Step 3: Recommend, create and report managed indexes
+    package = {
+        "batch_1": {
+            "process_1": {
+                "index": {
+                    "recommend": {"min_hits": 2},
+                    "apply": "recommended",
+                    "report": True
+                }
+            }
+        }
+    }
+    result = batch.handle_batch(package, conn, cursor, db_meta, tool_handlers)
+
+    # Step 4: Pretty print result
+    print("\n📇 Index Result:")
+    print(json.dumps(result, indent=2))
+
+    # Step 5: A fresh process must still start on the indexed database
+    # (ANALYZE adds sqlite_stat1, which schema validation has to skip)
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    check = subprocess.run(
+        [sys.executable, "-c", "from utils import connect; connect.get_env(); print('ok')"],
+        cwd=root, capture_output=True, text=True
+    )
+    if check.returncode == 0:
+        print("\n✅ New process starts after apply.")
+    else:
+        print("\n❌ New process failed to start after apply:")
+        print(check.stdout + check.stderr)
+
+if __name__ == "__main__":
+    main()
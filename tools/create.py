@@ -1,5 +1,16 @@
 import uuid
 
+from utils import allocator, cache
+from utils.sql import MAX_VARIABLES, chunks, executemany_chunked, placeholders, row_error
+
+def registered_uuids(cursor, uuids):
+    """Subset of `uuids` already in the Registry, via primary-key probes."""
+    found = set()
+    for chunk in chunks(list(uuids), MAX_VARIABLES):
+        cursor.execute(f"SELECT UUID FROM Registry WHERE UUID IN ({placeholders(len(chunk))})", chunk)
+        found.update(row[0] for row in cursor.fetchall())
+    return found
+
 def handle(package, conn, cursor, db_meta):
     result = {
         "status": "success",
@@ -10,16 +21,14 @@ def handle(package, conn, cursor, db_meta):
         }
     }
 
-    # Step 1: Load existing UUIDs from Registry
-    cursor.execute("SELECT UUID FROM Registry")
-    existing_uuids = {row[0] for row in cursor.fetchall()}
-
-    tables = db_meta["tables"]
-    fields = {table: set(cols) for table, cols in zip(tables, db_meta["fields"])}
+    # Step 1: Probe the Registry for the fixed UUIDs only
+    fixed_uuids = {g["_UUID"] for g in package.values() if g.get("_UUID")}
+    existing_uuids = registered_uuids(cursor, fixed_uuids)
 
     # Step 2: Identify groups needing UUIDs
     uuidless_groups = []
     static_uuid_groups = {}
+    claimed = set()
 
     for group_name, group_data in package.items():
         if "_UUID" in group_data and group_data["_UUID"]:
@@ -28,23 +37,47 @@ def handle(package, conn, cursor, db_meta):
                 result["errors"].append(f"group '{group_name}': UUID '{custom_uuid}' already exists in Registry.")
                 result["status"] = "partial"
                 continue
+            if custom_uuid in claimed:
+                result["errors"].append(f"group '{group_name}': UUID '{custom_uuid}' is used by an earlier group.")
+                result["status"] = "partial"
+                continue
+            claimed.add(custom_uuid)
             static_uuid_groups[group_name] = custom_uuid
         else:
             uuidless_groups.append(group_name)
 
-    # Step 3: Generate new UUIDs for uuidless groups
-    new_uuids = []
+    # Step 3: Generate new UUIDs for uuidless groups, re-rolling any the Registry already holds
+    new_uuids = set()
     while len(new_uuids) < len(uuidless_groups):
-        candidate = str(uuid.uuid4())
-        if candidate not in existing_uuids and candidate not in new_uuids:
-            new_uuids.append(candidate)
+        candidates = set()
+        while len(new_uuids) + len(candidates) < len(uuidless_groups):
+            candidate = str(uuid.uuid4())
+            if candidate not in claimed and candidate not in new_uuids:
+                candidates.add(candidate)
+        new_uuids |= candidates - registered_uuids(cursor, candidates)
+    new_uuids = list(new_uuids)
+
+    # Generated UUIDs have no rows anywhere; fixed ones get one grouped MAX(IND) per table
+    inds = allocator.for_cursor(cursor)
+    inds.mark_fresh(new_uuids)
+    fixed_by_table = {}
+    for group_name, uuid_val in static_uuid_groups.items():
+        for table in package[group_name].get("table", []):
+            if table in db_meta:
+                fixed_by_table.setdefault(table, []).append(uuid_val)
+    for table, uuids in fixed_by_table.items():
+        inds.prefetch(table, uuids)
 
     # Step 4: Fill back UUIDs into the package
     for group_name, uuid_val in zip(uuidless_groups, new_uuids):
         package[group_name]["_UUID"] = uuid_val
         static_uuid_groups[group_name] = uuid_val
 
-    # Step 5: Process inserts for each group
+    # Step 5: Collect rows per (table, field signature) across all groups
+    pending = {}      # (table, fields) -> ([rows], [group names])
+    registry_rows = []
+    registry_groups = []
+
     for group_name, group_data in package.items():
         if group_name not in static_uuid_groups:
             # Skip invalid UUID groups that failed earlier
@@ -52,18 +85,23 @@ def handle(package, conn, cursor, db_meta):
 
         try:
             uuid_val = static_uuid_groups[group_name]
-            result["action"]["created"].append(uuid_val)
 
+            # Check every row first: INDs are only handed out for a group that
+            # is written whole, so they stay contiguous and no Registry row is
+            # left without its data
+            checked = []
+            bad_rows = []
             for table, field_list, value_list in zip(
                 group_data["table"],
                 group_data["field"],
                 group_data["value"]
             ):
-                if table not in tables:
+                spec = db_meta.get(table)
+                if spec is None:
                     result["errors"].append(f"group '{group_name}': Table '{table}' does not exist.")
                     continue
 
-                missing = [f for f in field_list if f not in fields[table]]
+                missing = spec.missing(field_list)
                 if missing:
                     result["errors"].append(f"group '{group_name}': Missing fields in '{table}': {missing}")
                     continue
@@ -71,31 +109,48 @@ def handle(package, conn, cursor, db_meta):
                 if value_list and isinstance(value_list[0], (str, int, float)):
                     value_list = [value_list]
 
-                cursor.execute(f"SELECT MAX(IND) FROM {table} WHERE UUID = ?", (uuid_val,))
-                max_ind = cursor.fetchone()[0]
-                next_ind = (max_ind + 1) if max_ind is not None else 0
+                for position, values in enumerate(value_list):
+                    problem = row_error(field_list, values)
+                    if problem:
+                        bad_rows.append(f"group '{group_name}': {table} row {position}: {problem}")
+                checked.append((table, tuple(field_list), value_list))
 
-                field_str = ", ".join(["UUID", "IND"] + field_list)
-                sql = f"INSERT INTO {table} ({field_str}) VALUES ({', '.join(['?'] * (2 + len(field_list)))})"
+            if bad_rows:
+                result["errors"].extend(bad_rows)
+                result["status"] = "partial"
+                continue
+
+            result["action"]["created"].append(uuid_val)
+            for table, fields, value_list in checked:
+                next_ind = inds.take(table, uuid_val, len(value_list))
 
-                insert_count = 0
+                rows, groups = pending.setdefault((table, fields), ([], []))
                 for values in value_list:
-                    row = [uuid_val, next_ind] + values
-                    cursor.execute(sql, row)
+                    rows.append((uuid_val, next_ind, *values))
+                    groups.append(group_name)
                     next_ind += 1
-                    insert_count += 1
-
-                result["action"]["inserts"][table] = result["action"]["inserts"].get(table, 0) + insert_count
 
-            # Insert into Registry
-            cursor.execute("INSERT INTO Registry (UUID) VALUES (?);", (uuid_val,))
-            existing_uuids.add(uuid_val)
+            registry_rows.append((uuid_val,))
+            registry_groups.append(group_name)
 
         except Exception as e:
             result["errors"].append(f"group '{group_name}': {str(e)}")
             result["status"] = "partial"
 
-    conn.commit()
+    # Step 6: Flush with executemany, table rows first, then Registry
+    def on_error(group_name, e):
+        result["errors"].append(f"group '{group_name}': {str(e)}")
+
+    if registry_rows:
+        cache.touch(cursor, [table for table, _ in pending] + ["Registry"], [u for (u,) in registry_rows])
+
+    for (table, fields), (rows, groups) in pending.items():
+        sql = db_meta.get(table).insert_sql(fields)
+        insert_count = executemany_chunked(cursor, sql, rows, groups, on_error)
+        if insert_count:
+            result["action"]["inserts"][table] = result["action"]["inserts"].get(table, 0) + insert_count
+
+    executemany_chunked(cursor, "INSERT INTO Registry (UUID) VALUES (?);", registry_rows, registry_groups, on_error)
 
     if result["errors"] and not result["action"]["inserts"]:
         result["status"] = "error"
@@ -1,8 +1,72 @@
-def reindex_inds_for_uuid(conn, cursor, table, uuid):
-    cursor.execute(f"SELECT rowid FROM {table} WHERE UUID = ? ORDER BY IND ASC;", (uuid,))
-    rows = cursor.fetchall()
-    for new_ind, (rowid,) in enumerate(rows):
-        cursor.execute(f"UPDATE {table} SET IND = ? WHERE rowid = ?;", (new_ind, rowid))
+from utils import allocator, cache
+from utils.sql import stage_uuids
+
+def reindex_inds(cursor, table, uuids):
+    """Renumber IND to 0..n-1 (keeping order) for every UUID in `uuids`, set-based."""
+    staged = stage_uuids(cursor, uuids, "_reindex_uuids")
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _reindex (row_id INTEGER PRIMARY KEY, new_ind INTEGER);")
+    cursor.execute("DELETE FROM temp._reindex;")
+    cursor.execute(f"""
+        INSERT INTO temp._reindex (row_id, new_ind)
+        SELECT row_id, new_ind FROM (
+            SELECT rowid AS row_id, IND,
+                   ROW_NUMBER() OVER (PARTITION BY UUID ORDER BY IND) - 1 AS new_ind
+            FROM {table}
+            WHERE UUID IN (SELECT UUID FROM {staged})
+        )
+        WHERE new_ind <> IND;
+    """)
+    moved = cursor.rowcount
+    if not moved:
+        return 0
+
+    # Two passes via negative INDs so no row lands on an IND another row still holds
+    cursor.execute(f"""
+        UPDATE {table}
+        SET IND = -1 - (SELECT new_ind FROM temp._reindex WHERE row_id = {table}.rowid)
+        WHERE rowid IN (SELECT row_id FROM temp._reindex);
+    """)
+    cursor.execute(f"UPDATE {table} SET IND = -1 - IND WHERE rowid IN (SELECT row_id FROM temp._reindex);")
+    return moved
+
+def compact_inds(cursor, db_meta, tables=None):
+    """
+    Maintenance pass for deletes run with "_defer_reindex": find UUIDs whose
+    INDs have gaps and renumber them. Returns {table: rows moved}. Run it
+    through the index tool's "compact" option.
+    """
+    moved = {}
+    for table in tables or db_meta.data_tables:
+        cursor.execute(f"SELECT UUID FROM {table} GROUP BY UUID HAVING MIN(IND) <> 0 OR MAX(IND) + 1 <> COUNT(*);")
+        gapped = [row[0] for row in cursor.fetchall()]
+        if gapped:
+            cache.touch(cursor, [table], gapped)
+            moved[table] = reindex_inds(cursor, table, gapped)
+            allocator.for_cursor(cursor).forget(gapped)
+    return moved
+
+def purge_uuids(cursor, db_meta, uuids, result):
+    """Delete every row of `uuids` from each table and the Registry, one statement per table."""
+    cache.touch(cursor, db_meta.data_tables + ("Registry",), uuids)
+    staged = stage_uuids(cursor, uuids, "_purge_uuids")
+
+    for table in db_meta.data_tables:
+        try:
+            cursor.execute(f"DELETE FROM {table} WHERE UUID IN (SELECT UUID FROM {staged});")
+            count = cursor.rowcount
+            if count > 0:
+                result["action"]["deleted_rows"][table] = result["action"]["deleted_rows"].get(table, 0) + count
+        except Exception as e:
+            result["errors"].append(f"{table}[{len(uuids)} UUIDs]: {str(e)}")
+
+    try:
+        cursor.execute(f"SELECT UUID FROM Registry WHERE UUID IN (SELECT UUID FROM {staged});")
+        registered = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f"DELETE FROM Registry WHERE UUID IN (SELECT UUID FROM {staged});")
+        result["action"]["removed_uuids"].extend(u for u in uuids if u in registered)
+    except Exception as e:
+        result["errors"].append(f"Registry delete failed for {len(uuids)} UUIDs: {str(e)}")
 
 def handle(package, conn, cursor, db_meta):
     result = {
@@ -14,48 +78,36 @@ def handle(package, conn, cursor, db_meta):
         }
     }
 
-    tables = db_meta["tables"]
     affected = {}  # Track UUIDs that need reindexing per table
 
+    purge = []  # UUIDs deleted with where: ["all"], removed together below
+
+    # "_defer_reindex": true leaves IND gaps for compact_inds() to close later
+    defer_reindex = bool(package.get("_defer_reindex"))
+
     for uuid_key, data in package.items():
+        if uuid_key.startswith("_"):
+            continue
+
         where_list = data.get("where", [])
         ind_list = data.get("IND", [])
 
         if where_list == ["all"]:
-            for table in tables:
-                if table in ("sqlite_sequence", "Registry"):
-                    continue
-
-                try:
-                    cursor.execute(f"DELETE FROM {table} WHERE UUID = ?", (uuid_key,))
-                    count = cursor.rowcount
-                    if count > 0:
-                        result["action"]["deleted_rows"][table] = result["action"]["deleted_rows"].get(table, 0) + count
-                        affected.setdefault(table, set()).add(uuid_key)
-                except Exception as e:
-                    result["errors"].append(f"{table}[{uuid_key}]: {str(e)}")
-
-            try:
-                cursor.execute("DELETE FROM Registry WHERE UUID = ?", (uuid_key,))
-                if cursor.rowcount:
-                    result["action"]["removed_uuids"].append(uuid_key)
-            except Exception as e:
-                result["errors"].append(f"Registry delete failed for {uuid_key}: {str(e)}")
+            purge.append(uuid_key)
 
         else:
             for table_name, ind in zip(where_list, ind_list):
                 if table_name in ("Registry", "sqlite_sequence"):
                     result["errors"].append(f"Cannot delete directly from '{table_name}'")
                     continue
-                if table_name not in tables:
+                spec = db_meta.get(table_name)
+                if spec is None:
                     result["errors"].append(f"Table '{table_name}' does not exist")
                     continue
 
                 try:
-                    cursor.execute(
-                        f"DELETE FROM {table_name} WHERE UUID = ? AND IND = ?",
-                        (uuid_key, int(ind))
-                    )
+                    cache.touch(cursor, [table_name], [uuid_key])
+                    cursor.execute(spec.delete_row_sql, (uuid_key, int(ind)))
                     count = cursor.rowcount
                     if count > 0:
                         result["action"]["deleted_rows"][table_name] = result["action"]["deleted_rows"].get(table_name, 0) + count
@@ -63,11 +115,14 @@ def handle(package, conn, cursor, db_meta):
                 except Exception as e:
                     result["errors"].append(f"{table_name}[{uuid_key}, IND {ind}]: {str(e)}")
 
-    for table_name, uuid_set in affected.items():
-        for uuid in uuid_set:
-            reindex_inds_for_uuid(conn, cursor, table_name, uuid)
+    if purge:
+        purge_uuids(cursor, db_meta, purge, result)
+        allocator.for_cursor(cursor).forget(purge)
 
-    conn.commit()
+    if not defer_reindex:
+        for table_name, uuid_set in affected.items():
+            reindex_inds(cursor, table_name, uuid_set)
+            allocator.for_cursor(cursor).forget(uuid_set)
 
     if result["errors"] and not (result["action"]["deleted_rows"] or result["action"]["removed_uuids"]):
         result["status"] = "error"
@@ -0,0 +1,62 @@
+from tools.delete import compact_inds
+from utils import advisor
+
+def handle(package: dict, conn, cursor, db_meta) -> dict:
+    result = {
+        "status": "success",
+        "errors": [],
+        "action": {}
+    }
+
+    try:
+        # Drop first so a package can replace an index in one go
+        for name in package.get("drop", []):
+            try:
+                advisor.drop_index(cursor, name)
+                result["action"].setdefault("dropped", []).append(name)
+            except Exception as e:
+                result["errors"].append(f"drop '{name}': {str(e)}")
+
+        recommend = package.get("recommend")
+        if recommend:
+            min_hits = recommend.get("min_hits", 1) if isinstance(recommend, dict) else 1
+            result["action"]["recommendations"] = advisor.recommend(cursor, db_meta, min_hits)
+
+        apply = package.get("apply", [])
+        if apply == "recommended":
+            apply = result["action"].get("recommendations") or advisor.recommend(cursor, db_meta)
+        for entry in apply:
+            try:
+                name = advisor.create_index(cursor, db_meta, entry["table"], entry["fields"], entry.get("where"))
+                result["action"].setdefault("created", []).append(name)
+            except Exception as e:
+                result["errors"].append(f"create on '{entry.get('table')}': {str(e)}")
+
+        # Close IND gaps left by deletes run with "_defer_reindex"
+        compact = package.get("compact")
+        if compact:
+            tables = compact if isinstance(compact, list) else list(db_meta.data_tables)
+            unknown = [t for t in tables if not db_meta.is_data_table(t)]
+            for table in unknown:
+                result["errors"].append(f"compact: Table '{table}' does not exist.")
+            tables = [t for t in tables if t not in unknown]
+            if tables:
+                result["action"]["compacted"] = compact_inds(cursor, db_meta, tables)
+
+        if package.get("report"):
+            report = package["report"]
+            tables = report if isinstance(report, list) else None
+            result["action"]["indexes"] = advisor.report(cursor, db_meta, tables)
+            result["action"]["usage"] = advisor.usage()
+
+    except Exception as e:
+        result["status"] = "error"
+        result["errors"].append(str(e))
+        return result
+
+    if result["errors"] and not result["action"]:
+        result["status"] = "error"
+    elif result["errors"]:
+        result["status"] = "partial"
+
+    return result
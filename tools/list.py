@@ -1,3 +1,5 @@
+from utils import cache
+
 def handle(package: dict, conn, cursor, db_meta) -> dict:
     result = {
         "status": "success",
@@ -16,21 +18,29 @@ def handle(package: dict, conn, cursor, db_meta) -> dict:
 
         # Determine which tables to query
         if not tables or tables == ["all"]:
-            valid_tables = [t for t in db_meta["tables"] if t not in ("Registry", "sqlite_sequence")]
+            valid_tables = db_meta.data_tables
         else:
-            valid_tables = [t for t in tables if t in db_meta["tables"] and t not in ("Registry", "sqlite_sequence")]
-
-        for table in valid_tables:
-            fields = db_meta["fields"][db_meta["tables"].index(table)]
-            sql = f"SELECT * FROM {table} WHERE UUID = ? ORDER BY IND ASC"
-            cursor.execute(sql, (UUID,))
-            rows = cursor.fetchall()
-
-            # Store results under the table name
-            result["action"][table] = {
-                "fields": fields,
-                "rows": [list(row) for row in rows]
-            }
+            valid_tables = [t for t in tables if db_meta.is_data_table(t)]
+
+        # A list of UUIDs is answered per UUID: {uuid: {table: {...}}}
+        uuids = UUID if isinstance(UUID, list) else [UUID]
+
+        # Cached entities are skipped; a single UUID is fetched with one UNION ALL
+        # across tables, several with one chunked IN query per table
+        found = cache.read_entities(cursor, db_meta, valid_tables, uuids)
+
+        for uuid in uuids:
+            tables_out = {}
+            for table in valid_tables:
+                # Store results under the table name
+                tables_out[table] = {
+                    "fields": db_meta.get(table).fields,
+                    "rows": [list(row) for row in found[table][uuid]]
+                }
+            if isinstance(UUID, list):
+                result["action"][uuid] = tables_out
+            else:
+                result["action"] = tables_out
 
     except Exception as e:
         result["status"] = "error"
@@ -1,3 +1,5 @@
+from utils import cache
+
 def handle(package: dict, conn, cursor, db_meta) -> dict:
     result = {
         "status": "success",
@@ -7,21 +9,20 @@ def handle(package: dict, conn, cursor, db_meta) -> dict:
 
     try:
         uuids = package.get("UUID", [])
-        tables = [t for t in db_meta["tables"] if t not in ("Registry", "sqlite_sequence")]
 
         for uuid in uuids:
             result["action"][uuid] = {}
 
-            for table in tables:
-                fields = db_meta["fields"][db_meta["tables"].index(table)]
-                sql = f"SELECT {', '.join(fields)} FROM {table} WHERE UUID = ? ORDER BY IND ASC"
-                cursor.execute(sql, (uuid,))
-                rows = cursor.fetchall()
+        # Hot entities come from the cache; the rest are one chunked IN query per table
+        # (a single missing UUID is one UNION ALL across tables, see sql.select_entities)
+        found = cache.read_entities(cursor, db_meta, db_meta.data_tables, list(result["action"]))
 
+        for table in db_meta.data_tables:
+            for uuid, rows in found[table].items():
                 if rows:
                     result["action"][uuid][table] = {
-                        "fields": fields,
-                        "rows": rows
+                        "fields": db_meta.get(table).fields,
+                        "rows": list(rows)
                     }
 
     except Exception as e:
@@ -1,3 +1,5 @@
+from utils import advisor, cache, search_plan
+
 def handle(package: dict, conn, cursor, db_meta) -> dict:
     result = {
         "status": "success",
@@ -8,97 +10,50 @@ def handle(package: dict, conn, cursor, db_meta) -> dict:
     }
 
     try:
-        search = package
-        table_results = []
-
-        for table, fields in search.items():
-            if table not in db_meta["tables"]:
-                result["errors"].append(f"Table '{table}' does not exist.")
-                continue
-
-            where_clauses = []
-            parameters = []
-
-            for field, logic in fields.items():
-                if field not in db_meta["fields"][db_meta["tables"].index(table)]:
-                    result["errors"].append(f"Field '{field}' does not exist in table '{table}'.")
-                    continue
-
-                and_group = logic.get("and", [])
-                or_group = logic.get("or", [])
-                nand_group = logic.get("nand", [])
-                nor_group = logic.get("nor", [])
-
-                and_clauses = []
-                or_clauses = []
-                nand_clauses = []
-                nor_clauses = []
-
-                # AND
-                for rule in and_group:
-                    if "equals" in rule:
-                        and_clauses.append(f"{field} = ?")
-                        parameters.append(rule["equals"])
-                    elif "contains" in rule:
-                        and_clauses.append(f"{field} LIKE ?")
-                        parameters.append(f"%{rule['contains']}%")
-
-                # OR
-                for rule in or_group:
-                    if "equals" in rule:
-                        or_clauses.append(f"{field} = ?")
-                        parameters.append(rule["equals"])
-                    elif "contains" in rule:
-                        or_clauses.append(f"{field} LIKE ?")
-                        parameters.append(f"%{rule['contains']}%")
-
-                # NAND
-                for rule in nand_group:
-                    if "equals" in rule:
-                        nand_clauses.append(f"{field} = ?")
-                        parameters.append(rule["equals"])
-                    elif "contains" in rule:
-                        nand_clauses.append(f"{field} LIKE ?")
-                        parameters.append(f"%{rule['contains']}%")
-
-                # NOR
-                for rule in nor_group:
-                    if "equals" in rule:
-                        nor_clauses.append(f"{field} = ?")
-                        parameters.append(rule["equals"])
-                    elif "contains" in rule:
-                        nor_clauses.append(f"{field} LIKE ?")
-                        parameters.append(f"%{rule['contains']}%")
-
-                field_condition_parts = []
-
-                if and_clauses:
-                    field_condition_parts.append("(" + " AND ".join(and_clauses) + ")")
-                if or_clauses:
-                    field_condition_parts.append("(" + " OR ".join(or_clauses) + ")")
-                if nand_clauses:
-                    field_condition_parts.append("NOT (" + " AND ".join(nand_clauses) + ")")
-                if nor_clauses:
-                    field_condition_parts.append("NOT (" + " OR ".join(nor_clauses) + ")")
-
-                if field_condition_parts:
-                    where_clauses.append("(" + " OR ".join(field_condition_parts) + ")")
+        # Served from the result cache while none of its tables was written
+        key, tables = cache.search_key(package, db_meta)
+        cached = cache.cached_search(cursor, key, tables)
+        if cached is not None:
+            result["action"], result["errors"], usage = cached
+            for table, table_usage in usage:
+                advisor.record(table, table_usage)
+            if result["errors"]:
+                result["status"] = "partial"
+            return result
+        stamp = cache.generations(tables)
+
+        # Compiled once per package shape, see utils/search_plan.py
+        plan = search_plan.plan_for(package, db_meta, cursor)
+        result["errors"].extend(plan.errors)
+
+        for table, usage in plan.usage:
+            advisor.record(table, usage)
+
+        if plan.count_only:
+            count = 0
+            if plan.sql:
+                cursor.execute(plan.sql, plan.parameters(package))
+                count = cursor.fetchone()[0]
+            # only the count, no (empty) matches list beside it
+            result["action"] = {"count": count}
+        elif plan.sql:
+            cursor.execute(plan.sql, plan.parameters(package))
+            result["action"]["matches"] = [row[0] for row in cursor.fetchall()]
+        else:
+            result["action"]["matches"] = []
 
-            if not where_clauses:
-                continue
+        # A full page in UUID order may have more behind it
+        limit = package.get("_limit")
+        if limit is not None and not plan.count_only:
+            matches = result["action"]["matches"]
+            full = plan.keyset and limit and len(matches) == limit
+            result["action"]["next_cursor"] = matches[-1] if full else None
 
-            sql = f"SELECT UUID FROM {table} WHERE " + " AND ".join(where_clauses)
-            cursor.execute(sql, parameters)
-            rows = cursor.fetchall()
-            uuids = set(row[0] for row in rows)
-            table_results.append(uuids)
+        cache.store_search(cursor, key, stamp, result["action"], result["errors"], plan.usage)
 
-        if len(table_results) == 1:
-            result["action"]["matches"] = list(table_results[0])
-        elif table_results:
-            result["action"]["matches"] = list(set.intersection(*table_results))
-        else:
-            result["action"]["matches"] = []
+        # unknown tables, fields or operators: the other rules still ran
+        if result["errors"]:
+            result["status"] = "partial"
 
     except Exception as e:
         result["status"] = "error"
@@ -1,21 +1,76 @@
+from utils import allocator, cache
+from utils.sql import MAX_VARIABLES, chunks, executemany_chunked, row_error
+
 def handle(package, conn, cursor, db_meta):
     result = {
         "status": "success",
         "errors": [],
         "action": {
             "updates": {},
-            "inserts": {}
+            "inserts": {},
+            "unchanged": {}
         }
     }
 
-    tables = db_meta["tables"]
-    fields = {table: set(cols) for table, cols in zip(tables, db_meta["fields"])}
+    # One grouped MAX(IND) per table for every UUID that gets new rows
+    inds = allocator.for_cursor(cursor)
+    new_rows_by_table = {}
+    for uuid_key, data in package.items():
+        for table, ind_list in zip(data.get("table", []), data.get("IND", [])):
+            if table in db_meta and any(isinstance(i, str) and i.startswith("new") for i in ind_list):
+                new_rows_by_table.setdefault(table, []).append(uuid_key)
+    for table, uuids in new_rows_by_table.items():
+        inds.prefetch(table, uuids)
+
+    uuids_by_table = {}
+    for uuid_key, data in package.items():
+        for table in data.get("table", []):
+            if table in db_meta:
+                uuids_by_table.setdefault(table, []).append(uuid_key)
+    for table, uuids in uuids_by_table.items():
+        cache.touch(cursor, [table], uuids)
+
+    # Rows are queued per (table, field signature) and written with executemany
+    pending_updates = {}   # (table, fields) -> (rows, error tags)
+    pending_inserts = {}
+    queued = {}            # (table, UUID, IND) -> signature it is queued under
+
+    def on_error(tag, e):
+        result["errors"].append(f"{tag}: {str(e)}")
+
+    def flush_updates():
+        for (table, fields), (rows, tags) in pending_updates.items():
+            spec = db_meta.get(table)
+
+            # Rows that exist; those the guarded UPDATE leaves alone already held the values
+            keys = [row[-2:] for row in rows]
+            existing = set()
+            for chunk in chunks(keys, MAX_VARIABLES // 2):
+                cursor.execute(spec.keys_in_sql(len(chunk)), [v for key in chunk for v in key])
+                existing.update(cursor.fetchall())
+
+            failed = set()
+            def on_row_error(tag, e):
+                failed.add(tag)
+                on_error(tag, e)
+
+            guarded = [row + row[:-2] for row in rows]
+            update_count = executemany_chunked(cursor, spec.update_sql(fields), guarded, tags, on_row_error)
+            matched = sum(1 for key, tag in zip(keys, tags) if key in existing and tag not in failed)
+
+            if update_count:
+                result["action"]["updates"][table] = result["action"]["updates"].get(table, 0) + update_count
+            if matched > update_count:
+                result["action"]["unchanged"][table] = result["action"]["unchanged"].get(table, 0) + matched - update_count
+        pending_updates.clear()
+        queued.clear()
 
     for uuid_key, data in package.items():
         for table, field_list, ind_list, value_list in zip(
             data["table"], data["field"], data["IND"], data["value"]
         ):
-            if table not in tables:
+            spec = db_meta.get(table)
+            if spec is None:
                 result["errors"].append(f"Table '{table}' does not exist.")
                 continue
 
@@ -24,14 +79,12 @@ def handle(package, conn, cursor, db_meta):
             for f in field_list:
                 all_fields.extend(f if isinstance(f, list) else [f])
 
-            missing = [f for f in all_fields if f not in fields[table]]
+            missing = spec.missing(all_fields)
             if missing:
                 result["errors"].append(f"Missing fields in '{table}': {missing}")
                 continue
 
             insert_groups = {}
-            update_count = 0
-            insert_count = 0
 
             for fields_sub, ind_sub, values_sub in zip(field_list, ind_list, value_list):
                 if isinstance(ind_sub, str) and ind_sub.startswith("new"):
@@ -42,42 +95,55 @@ def handle(package, conn, cursor, db_meta):
                     if isinstance(values_sub, str):
                         values_sub = [values_sub]
 
+                    tag = f"{table}[{uuid_key}, IND {ind_sub}]"
                     try:
-                        set_clause = ", ".join(f"{f} = ?" for f in fields_sub)
-                        sql = f"UPDATE {table} SET {set_clause} WHERE UUID = ? AND IND = ?"
-                        cursor.execute(sql, (*values_sub, uuid_key, int(ind_sub)))
-                        update_count += cursor.rowcount
+                        row = (*values_sub, uuid_key, int(ind_sub))
                     except Exception as e:
-                        result["errors"].append(f"{table}[{uuid_key}, IND {ind_sub}]: {str(e)}")
+                        result["errors"].append(f"{tag}: {str(e)}")
+                        continue
+
+                    key = (table, tuple(fields_sub))
+                    # A row already queued under another field signature is flushed first,
+                    # so later entries still win
+                    target = (table, uuid_key, row[-1])
+                    if queued.get(target, key) != key:
+                        flush_updates()
+                    queued[target] = key
+                    rows, tags = pending_updates.setdefault(key, ([], []))
+                    rows.append(row)
+                    tags.append(tag)
 
             for _, field_value_list in insert_groups.items():
                 try:
-                    cursor.execute(f"SELECT MAX(IND) FROM {table} WHERE UUID = ?", (uuid_key,))
-                    max_ind = cursor.fetchone()[0]
-                    next_ind = (max_ind + 1) if max_ind is not None else 0
-
                     merged_fields = []
                     merged_values = []
                     for f_set, v_set in field_value_list:
                         merged_fields.extend(f_set if isinstance(f_set, list) else [f_set])
                         merged_values.extend(v_set if isinstance(v_set, list) else [v_set])
 
-                    field_str = ", ".join(["UUID", "IND"] + merged_fields)
-                    sql = f"INSERT INTO {table} ({field_str}) VALUES ({', '.join(['?'] * (2 + len(merged_fields)))})"
-                    cursor.execute(sql, [uuid_key, next_ind] + merged_values)
-                    insert_count += 1
+                    # an IND is only taken for a row that can be written, so INDs stay contiguous
+                    problem = row_error(merged_fields, merged_values)
+                    if problem:
+                        result["errors"].append(f"{table}[{uuid_key}, insert]: {problem}")
+                        continue
+                    next_ind = inds.take(table, uuid_key)
+
+                    rows, tags = pending_inserts.setdefault((table, tuple(merged_fields)), ([], []))
+                    rows.append((uuid_key, next_ind, *merged_values))
+                    tags.append(f"{table}[{uuid_key}, insert]")
 
                 except Exception as e:
                     result["errors"].append(f"{table}[{uuid_key}, insert]: {str(e)}")
 
-            if update_count:
-                result["action"]["updates"][table] = result["action"]["updates"].get(table, 0) + update_count
-            if insert_count:
-                result["action"]["inserts"][table] = result["action"]["inserts"].get(table, 0) + insert_count
+    # Updates first, then inserts, as each UUID/table did before
+    flush_updates()
 
-    conn.commit()
+    for (table, fields), (rows, tags) in pending_inserts.items():
+        insert_count = executemany_chunked(cursor, db_meta.get(table).insert_sql(fields), rows, tags, on_error)
+        if insert_count:
+            result["action"]["inserts"][table] = result["action"]["inserts"].get(table, 0) + insert_count
 
-    if result["errors"] and not (result["action"]["updates"] or result["action"]["inserts"]):
+    if result["errors"] and not any(result["action"].values()):
         result["status"] = "error"
     elif result["errors"]:
         result["status"] = "partial"
@@ -0,0 +1,186 @@
+import threading
+from collections import Counter
+
+# ─────────────────────────────────────────────
+# Index advisor
+# ─────────────────────────────────────────────
+# search records which fields each query filters on. From that this module
+# recommends secondary indexes, creates/drops the ones it manages (named
+# ix_<table>__<fields>) and reports their size and how many recorded queries
+# could use them. Usage is kept in memory for the life of the process.
+
+MANAGED_PREFIX = "ix_"
+# Rules a b-tree index can answer. is_null is left out: sparse fields get a
+# partial "IS NOT NULL" index, which cannot serve it.
+INDEXABLE_OPS = {"equals", "in", "starts_with", "gt", "gte", "lt", "lte", "between"}
+SPARSE_RATIO = 0.5  # above this share of NULLs an index only covers non-NULL rows
+
+_lock = threading.Lock()
+_searches = Counter()   # table -> searches recorded
+_fields = Counter()     # (table, field) -> searches filtering on it with an indexable rule
+_combos = Counter()     # (table, fields tuple) -> searches filtering on exactly those fields
+
+def record(table, usage):
+    """
+    Note one search on `table`. `usage` is a list of (field, group, op)
+    for every rule. A field counts as indexable when all of its rules are
+    and/or rules using an operator in INDEXABLE_OPS.
+    """
+    by_field = {}
+    for field, group, op in usage:
+        ok = group in ("and", "or") and op in INDEXABLE_OPS
+        by_field[field] = by_field.get(field, True) and ok
+    indexable = tuple(sorted(f for f, ok in by_field.items() if ok))
+
+    with _lock:
+        _searches[table] += 1
+        for field in indexable:
+            _fields[(table, field)] += 1
+        if indexable:
+            _combos[(table, indexable)] += 1
+
+def reset():
+    with _lock:
+        _searches.clear()
+        _fields.clear()
+        _combos.clear()
+
+def usage():
+    with _lock:
+        return {
+            "searches": dict(_searches),
+            "fields": {f"{t}.{f}": n for (t, f), n in _fields.items()},
+        }
+
+# ─────────────────────────────────────────────
+# Existing indexes
+# ─────────────────────────────────────────────
+def index_name(table, fields, where=None):
+    suffix = "__p" if where else ""
+    return f"{MANAGED_PREFIX}{table}__{'_'.join(fields)}{suffix}"
+
+def existing_indexes(cursor, table):
+    """[(name, [fields], managed)] for every index on `table`, including the primary key."""
+    found = []
+    cursor.execute(f"PRAGMA index_list({table});")
+    for row in cursor.fetchall():
+        name = row[1]
+        cursor.execute(f"PRAGMA index_info({name});")
+        cols = [r[2] for r in sorted(cursor.fetchall())]
+        found.append((name, cols, name.startswith(MANAGED_PREFIX)))
+    return found
+
+def _covered(indexes, fields):
+    """True when some index already starts with `fields` in that order."""
+    fields = list(fields)
+    return any(cols[:len(fields)] == fields for _, cols, _ in indexes)
+
+# ─────────────────────────────────────────────
+# Recommendations
+# ─────────────────────────────────────────────
+def recommend(cursor, db_meta, min_hits=1):
+    """
+    Suggested indexes as [{"table", "fields", "where", "hits", "sql"}], most
+    used first. Single fields come from per-field usage, composites from
+    fields queried together; sparse single fields get a partial index.
+    """
+    with _lock:
+        fields = dict(_fields)
+        combos = dict(_combos)
+
+    candidates = []
+    for (table, field), hits in fields.items():
+        if hits >= min_hits:
+            candidates.append((table, (field,), hits))
+    for (table, combo), hits in combos.items():
+        if len(combo) > 1 and hits >= min_hits:
+            # most frequently filtered field leads
+            ordered = tuple(sorted(combo, key=lambda f: (-fields.get((table, f), 0), f)))
+            candidates.append((table, ordered, hits))
+
+    suggestions = []
+    indexes_by_table = {}
+    for table, cols, hits in sorted(candidates, key=lambda c: (-c[2], -len(c[1]), c[0], c[1])):
+        if not db_meta.is_data_table(table):
+            continue
+        indexes = indexes_by_table.get(table)
+        if indexes is None:
+            indexes = indexes_by_table[table] = existing_indexes(cursor, table)
+        if _covered(indexes, cols):
+            continue
+
+        where = None
+        if len(cols) == 1:
+            cursor.execute(f"SELECT COUNT(*), COUNT({cols[0]}) FROM {table};")
+            total, filled = cursor.fetchone()
+            if total and (total - filled) / total > SPARSE_RATIO:
+                where = f"{cols[0]} IS NOT NULL"
+
+        suggestions.append({
+            "table": table,
+            "fields": list(cols),
+            "where": where,
+            "hits": hits,
+            "sql": index_sql(table, cols, where)
+        })
+        # later, shorter candidates with the same leading fields are covered now
+        indexes.append((index_name(table, cols, where), list(cols), True))
+
+    return suggestions
+
+# ─────────────────────────────────────────────
+# Managed indexes
+# ─────────────────────────────────────────────
+def index_sql(table, fields, where=None):
+    sql = f"CREATE INDEX IF NOT EXISTS {index_name(table, fields, where)} ON {table} ({', '.join(fields)})"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+def create_index(cursor, db_meta, table, fields, where=None):
+    spec = db_meta.get(table)
+    if spec is None or not db_meta.is_data_table(table):
+        raise ValueError(f"Table '{table}' does not exist.")
+    missing = spec.missing(fields)
+    if missing:
+        raise ValueError(f"Missing fields in '{table}': {missing}")
+
+    cursor.execute(index_sql(table, fields, where) + ";")
+    cursor.execute(f"ANALYZE {index_name(table, fields, where)};")
+    return index_name(table, fields, where)
+
+def drop_index(cursor, name):
+    if not name.startswith(MANAGED_PREFIX):
+        raise ValueError(f"Index '{name}' is not managed by the advisor.")
+    cursor.execute(f"DROP INDEX IF EXISTS {name};")
+
+def report(cursor, db_meta, tables=None):
+    """Managed indexes with their size in bytes (None without dbstat) and hit rate."""
+    with _lock:
+        searches = dict(_searches)
+        combos = dict(_combos)
+
+    rows = []
+    for table in tables or db_meta.data_tables:
+        for name, cols, managed in existing_indexes(cursor, table):
+            if not managed:
+                continue
+            try:
+                cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?;", (name,))
+                size = cursor.fetchone()[0]
+            except Exception:
+                size = None
+
+            # a recorded search could use the index when it filters on its leading field
+            hits = sum(n for (t, combo), n in combos.items() if t == table and cols[0] in combo)
+            total = searches.get(table, 0)
+            rows.append({
+                "name": name,
+                "table": table,
+                "fields": cols,
+                "size_bytes": size,
+                "hits": hits,
+                "searches": total,
+                "hit_rate": (hits / total) if total else None
+            })
+    return rows
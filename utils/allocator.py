@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+
+from utils.sql import MAX_VARIABLES, chunks, placeholders
+
+# ─────────────────────────────────────────────
+# IND allocation
+# ─────────────────────────────────────────────
+# Hands out the next IND per (table, UUID) without a MAX(IND) query per
+# insert: UUIDs generated in this batch start at 0, existing UUIDs are
+# looked up with one grouped query per table, and the next value is kept
+# for the rest of the batch. handle_batch opens a scope per connection so
+# create and update share one allocator.
+
+_scopes = {}  # id(connection) -> IndAllocator
+
+class IndAllocator:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self._next = {}      # (table, UUID) -> next IND
+        self._fresh = set()  # UUIDs known to have no rows yet
+
+    def mark_fresh(self, uuids):
+        self._fresh.update(uuids)
+
+    def prefetch(self, table, uuids):
+        wanted = [u for u in set(uuids) if (table, u) not in self._next and u not in self._fresh]
+
+        for chunk in chunks(wanted, MAX_VARIABLES):
+            self.cursor.execute(
+                f"SELECT UUID, MAX(IND) FROM {table} WHERE UUID IN ({placeholders(len(chunk))}) GROUP BY UUID",
+                chunk
+            )
+            for uuid, max_ind in self.cursor.fetchall():
+                self._next[(table, uuid)] = max_ind + 1
+
+        for uuid in wanted:
+            self._next.setdefault((table, uuid), 0)
+
+    def take(self, table, uuid, count=1):
+        """Reserve `count` consecutive INDs for (table, uuid) and return the first."""
+        key = (table, uuid)
+        start = self._next.get(key)
+        if start is None:
+            if uuid in self._fresh:
+                start = 0
+            else:
+                self.prefetch(table, (uuid,))
+                start = self._next[key]
+        self._next[key] = start + count
+        return start
+
+    def forget(self, uuids=None):
+        """Drop cached values (all, or for `uuids`) after rows were removed or renumbered."""
+        if uuids is None:
+            self._next.clear()
+            self._fresh.clear()
+            return
+        uuids = set(uuids)
+        self._fresh -= uuids
+        for key in [k for k in self._next if k[1] in uuids]:
+            del self._next[key]
+
+@contextmanager
+def batch_scope(cursor):
+    key = id(cursor.connection)
+    alloc = IndAllocator(cursor)
+    _scopes[key] = alloc
+    try:
+        yield alloc
+    finally:
+        _scopes.pop(key, None)
+
+def for_cursor(cursor):
+    """The batch's allocator for this connection, or a throwaway one outside handle_batch."""
+    return _scopes.get(id(cursor.connection)) or IndAllocator(cursor)
+
+def reset(cursor):
+    alloc = _scopes.get(id(cursor.connection))
+    if alloc is not None:
+        alloc.forget()
@@ -1,4 +1,78 @@
 import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import allocator, cache, connect
+
+# ─────────────────────────────────────────────
+# Savepoints
+# ─────────────────────────────────────────────
+# handle_batch owns the transaction: the whole batch runs in one scope and
+# each tool call gets its own nested SAVEPOINT, rolled back on its own if
+# the tool raises or reports "error". Tools never commit.
+#
+# The outermost scope of a package that writes is BEGIN IMMEDIATE rather
+# than a SAVEPOINT: a deferred transaction would read first and then have
+# to upgrade to a write lock, which in WAL mode fails at once with
+# "database is locked" when another connection committed in between,
+# instead of waiting out the busy timeout. A read-only package gets a
+# deferred BEGIN, one WAL snapshot that never waits for writers. Inside an
+# open transaction the scope is a SAVEPOINT.
+def has_writes(raw_package):
+    """True when some tool call in `raw_package` may write (any tool outside READ_ONLY_TOOLS)."""
+    # malformed parts are left for _iter_batches to report
+    return any(
+        tool not in READ_ONLY_TOOLS and is_valid_data(tool_data)
+        for batch in raw_package.values() if isinstance(batch, dict)
+        for process in batch.values() if isinstance(process, dict)
+        for tool, tool_data in process.items()
+    )
+
+def _open_scope(cursor, name, write=True):
+    """Open scope `name`; True when it began the transaction (see _close_scope)."""
+    if cursor.connection.in_transaction:
+        _savepoint(cursor, name)
+        return False
+    cursor.execute("BEGIN IMMEDIATE;" if write else "BEGIN;")
+    return True
+
+def _close_scope(cursor, name, outermost):
+    cursor.execute("COMMIT;" if outermost else f"RELEASE {name};")
+    cache.settle(cursor)
+
+def _abort_scope(cursor, name, outermost):
+    if outermost:
+        cursor.execute("ROLLBACK;")
+        cache.settle(cursor)
+    else:
+        _rollback(cursor, name)
+
+def _savepoint(cursor, name):
+    cursor.execute(f"SAVEPOINT {name};")
+
+def _release(cursor, name):
+    cursor.execute(f"RELEASE {name};")
+
+def _rollback(cursor, name):
+    cursor.execute(f"ROLLBACK TO {name};")
+    cursor.execute(f"RELEASE {name};")
+    # cached results may have been computed from the rolled-back rows
+    cache.settle(cursor)
+
+def run_in_savepoint(cursor, name, call):
+    _savepoint(cursor, name)
+    try:
+        output = call()
+    except Exception:
+        _rollback(cursor, name)
+        allocator.reset(cursor)
+        raise
+
+    if output.get("status") == "error":
+        _rollback(cursor, name)
+        allocator.reset(cursor)
+    else:
+        _release(cursor, name)
+    return output
 
 def is_valid_data(d):
     if not isinstance(d, dict) or not d:
@@ -14,13 +88,160 @@ def is_valid_data(d):
             return True
     return False
 
-def handle_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict):
+# ─────────────────────────────────────────────
+# Parallel read-only tools
+# ─────────────────────────────────────────────
+# With parallel=True the read-only passthrough tools of a batch run on a
+# thread pool, each on its own pooled connection inside its own deferred
+# transaction (one WAL snapshot of the committed data per tool). That snapshot would miss writes earlier batches made
+# in this still-open transaction, so a batch only goes parallel while the
+# connection has no uncommitted writes; otherwise it runs sequentially.
+# Outputs are merged in package order either way.
+READ_ONLY_TOOLS = ("read", "list", "search")
+DEFAULT_MAX_WORKERS = 4
+
+def _run_read_only(pool, handler, tool_data, db_meta):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        # one deferred transaction, so every statement of the tool reads the same snapshot
+        cursor.execute("BEGIN;")
+        try:
+            output = handler(tool_data, conn, cursor, db_meta)
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+        cursor.execute("COMMIT;")
+        return output
+
+
+def _run_passthrough(calls, conn, cursor, db_meta, tool_handlers, parallel, max_workers):
+    """Yield (output, exception) for each (tool, tool_data) in `calls`, in order, as each is ready."""
+
+    def run_here(index):
+        tool, tool_data = calls[index]
+        try:
+            return run_in_savepoint(
+                cursor, f"tool_{tool}",
+                lambda: tool_handlers[tool](tool_data, conn, cursor, db_meta)
+            ), None
+        except Exception as e:
+            return None, e
+
+    read_only = [i for i, (tool, _) in enumerate(calls) if tool in READ_ONLY_TOOLS and tool in tool_handlers]
+    # workers open their connections from the pool `conn` came from, i.e. the same database
+    pool = connect.pool if parallel else None
+    # with a single connection the caller's is the only one, so no worker could get one
+    if (len(read_only) < 2 or pool is None or pool.size < 2 or not pool.owns(conn)
+            or cache.has_pending(cursor)):
+        for index in range(len(calls)):
+            yield run_here(index)
+        return
+
+    # the calling thread keeps its own connection checked out
+    workers = max(1, min(max_workers or DEFAULT_MAX_WORKERS, len(read_only), pool.size - 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            index: executor.submit(_run_read_only, pool, tool_handlers[calls[index][0]], calls[index][1], db_meta)
+            for index in read_only
+        }
+        # any other passthrough tool runs here meanwhile, in package order
+        for index in range(len(calls)):
+            if index not in futures:
+                yield run_here(index)
+                continue
+            try:
+                yield futures.pop(index).result(), None
+            except Exception as e:
+                yield None, e
+
+# ─────────────────────────────────────────────
+# Batch handling
+# ─────────────────────────────────────────────
+# iter_batch yields every tool output as soon as it is ready, keyed by
+# (batch key, process key, tool), so a caller can write each one out and
+# drop it. Create/update/delete are merged across the processes of a batch
+# before they run; their outputs carry None as the process key. The last
+# item is (None, summary) with the package's "status" and "errors", once
+# the transaction is committed or, with atomic=True, rolled back.
+def _escalate(summary, output):
+    if output.get("status") in ("error", "partial"):
+        summary["status"] = "partial" if summary["status"] == "success" else "error"
+        summary["errors"].extend(output.get("errors", []))
+
+def _failed(summary, tool, error):
+    summary["status"] = "error"
+    err_msg = f"{tool} failed: {str(error)}"
+    summary["errors"].append(err_msg)
+    return {
+        "status": "error",
+        "errors": [err_msg],
+        "action": {}
+    }
+
+def iter_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict, atomic: bool = False,
+               parallel: bool = False, max_workers: int = None):
+    """
+    Generator running `raw_package` like handle_batch. Yields
+    ((batch, process, tool), output) per tool call, then (None, summary)
+    where summary is {"status", "errors", "rolled_back"}.
+
+    The transaction stays open until the generator is exhausted; closing it
+    early rolls the whole package back.
+    """
+    summary = {
+        "status": "success",
+        "errors": []
+    }
+
+    outermost = _open_scope(cursor, "batch", has_writes(raw_package))
+    try:
+        with allocator.batch_scope(cursor):
+            yield from _iter_batches(raw_package, conn, cursor, db_meta, tool_handlers, summary, parallel, max_workers)
+    except BaseException:
+        # also GeneratorExit, when the caller stops iterating
+        _abort_scope(cursor, "batch", outermost)
+        raise
+
+    if atomic and summary["errors"]:
+        _abort_scope(cursor, "batch", outermost)
+        summary["status"] = "error"
+        summary["rolled_back"] = True
+    else:
+        _close_scope(cursor, "batch", outermost)
+        summary["rolled_back"] = False
+
+    yield None, summary
+
+def handle_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict, atomic: bool = False,
+                 parallel: bool = False, max_workers: int = None):
+    """
+    Run every batch in `raw_package` in a single transaction.
+
+    A tool that fails only rolls back its own savepoint; with `atomic=True`
+    any failure rolls back the whole package instead. `parallel=True` runs
+    the read-only tools of each batch concurrently (see READ_ONLY_TOOLS).
+    Collects iter_batch() into one result; passthrough actions are merged
+    flat, so a later search's "matches" replaces an earlier one's.
+    """
     batch_result = {
         "status": "success",
         "errors": [],
         "action": {}
     }
 
+    for key, output in iter_batch(raw_package, conn, cursor, db_meta, tool_handlers, atomic, parallel, max_workers):
+        if key is None:
+            batch_result["status"] = output["status"]
+            batch_result["errors"] = output["errors"]
+        elif key[1] is None:
+            batch_result["action"][key[2]] = output
+        else:
+            # 🧩 Only merge the actual action output (flattened)
+            batch_result["action"].update(output.get("action", {}))
+
+    return batch_result
+
+def _iter_batches(raw_package, conn, cursor, db_meta, tool_handlers, summary, parallel=False, max_workers=None):
     for batch_key, batch in raw_package.items():
         reorganized = {
             "create": {},
@@ -28,8 +249,9 @@ def handle_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict):
             "delete": {}
         }
         group_counter = 1
+        passthrough = []
 
-        for process in batch.values():
+        for process_key, process in batch.items():
             for tool, tool_data in process.items():
                 if not is_valid_data(tool_data):
                     continue
@@ -38,21 +260,7 @@ def handle_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict):
                 # 🧪 Passthrough tools: read/search
                 # ──────────────────────────────
                 if tool not in ("create", "update", "delete"):
-                    try:
-                        output = tool_handlers[tool](tool_data, conn, cursor, db_meta)
-
-                        # 🧩 Only merge the actual action output (flattened)
-                        batch_result["action"].update(output.get("action", {}))
-
-                        if output.get("status") in ("error", "partial"):
-                            batch_result["status"] = "partial" if batch_result["status"] == "success" else "error"
-                            batch_result["errors"].extend(output.get("errors", []))
-
-                    except Exception as e:
-                        batch_result["status"] = "error"
-                        err_msg = f"{tool} failed: {str(e)}"
-                        batch_result["errors"].append(err_msg)
-
+                    passthrough.append((process_key, tool, tool_data))
                     continue
 
                 # ──────────────────────────────
@@ -66,35 +274,34 @@ def handle_batch(raw_package: dict, conn, cursor, db_meta, tool_handlers: dict):
                 elif tool in ("update", "delete"):
                     reorganized[tool].update(tool_data)
 
+        # ──────────────────────────────
+        # Passthrough tools run before the batch's writes
+        # ──────────────────────────────
+        calls = [(tool, tool_data) for _, tool, tool_data in passthrough]
+        outputs = _run_passthrough(calls, conn, cursor, db_meta, tool_handlers, parallel, max_workers)
+        for (process_key, tool, _), (output, error) in zip(passthrough, outputs):
+            if error is not None:
+                output = _failed(summary, tool, error)
+            else:
+                _escalate(summary, output)
+            yield (batch_key, process_key, tool), output
+
         # ──────────────────────────────
         # Run C → U → D in order
         # ──────────────────────────────
         for tool in ["create", "update", "delete"]:
             if reorganized[tool] and tool in tool_handlers:
                 try:
-                    output = tool_handlers[tool](reorganized[tool], conn, cursor, db_meta)
+                    output = run_in_savepoint(
+                        cursor, f"tool_{tool}",
+                        lambda: tool_handlers[tool](reorganized[tool], conn, cursor, db_meta)
+                    )
                     wrapped = {
                         "status": output.get("status", "unknown"),
                         "errors": output.get("errors", []),
                         "action": output.get("action", {})
                     }
-                    batch_result["action"][tool] = wrapped
-
-                    if wrapped["status"] in ("error", "partial"):
-                        batch_result["status"] = "partial" if batch_result["status"] == "success" else "error"
-                        batch_result["errors"].extend(wrapped["errors"])
-
+                    _escalate(summary, wrapped)
                 except Exception as e:
-                    batch_result["status"] = "error"
-                    err_msg = f"{tool} failed: {str(e)}"
-                    batch_result["errors"].append(err_msg)
-                    batch_result["action"][tool] = {
-                        "status": "error",
-                        "errors": [err_msg],
-                        "action": {}
-                    }
-
-    if conn:
-        conn.commit()
-
-    return batch_result
+                    wrapped = _failed(summary, tool, e)
+                yield (batch_key, None, tool), wrapped
@@ -0,0 +1,274 @@
+import json
+import sys
+import threading
+from collections import Counter, OrderedDict
+
+from utils import sql
+
+# ─────────────────────────────────────────────
+# Write generations
+# ─────────────────────────────────────────────
+# Every table has a generation counter. The write tools bump it through
+# touch() before changing rows; a cached result stores the generations of
+# the tables it read and is only served while they are unchanged.
+#
+# Writes are also remembered per connection until they commit: settle()
+# bumps those tables again once the transaction ends (commit or rollback),
+# so results other connections cached from the pre-commit snapshot, or
+# results from a rolled-back write, go stale too. While a connection has
+# uncommitted writes it bypasses the caches, since it sees rows nobody else
+# does yet.
+#
+# Entities are invalidated per (UUID, table) instead. A read only stores
+# what it fetched when no entity was invalidated while it ran (the entity
+# epoch is unchanged), so a snapshot older than a concurrent commit is
+# never cached.
+
+_lock = threading.Lock()
+_generations = Counter()   # table -> generation
+_pending = {}              # id(connection) -> (tables, entity keys) written in its open transaction
+_entity_epoch = [0]
+
+def generations(tables):
+    with _lock:
+        return tuple(_generations[t] for t in tables)
+
+def entity_epoch():
+    with _lock:
+        return _entity_epoch[0]
+
+def touch(cursor, tables, uuids=()):
+    """
+    Record that the connection behind `cursor` is about to write `tables`,
+    touching rows of `uuids` in them.
+    """
+    tables = set(tables)
+    if not tables:
+        return
+    keys = {(uuid, table) for uuid in uuids for table in tables}
+    with _lock:
+        for table in tables:
+            _generations[table] += 1
+        pending_tables, pending_keys = _pending.setdefault(id(cursor.connection), (set(), set()))
+        pending_tables.update(tables)
+        pending_keys.update(keys)
+        if keys:
+            _entity_epoch[0] += 1
+    entities.discard_many(keys)
+
+def has_pending(cursor):
+    with _lock:
+        return id(cursor.connection) in _pending
+
+def settle(cursor):
+    """
+    Bump the tables written on this connection again. Call after a rollback
+    or after the transaction commits; the record is kept until no
+    transaction is open any more.
+    """
+    key = id(cursor.connection)
+    with _lock:
+        if key not in _pending:
+            return
+        tables, keys = _pending[key]
+        for table in tables:
+            _generations[table] += 1
+        if keys:
+            _entity_epoch[0] += 1
+        if not cursor.connection.in_transaction:
+            del _pending[key]
+    entities.discard_many(keys)
+
+# ─────────────────────────────────────────────
+# LRU cache
+# ─────────────────────────────────────────────
+class LRUCache:
+    """
+    Thread-safe LRU map with hit/miss/eviction counters. With `max_bytes`
+    it also evicts once the entries' `sizeof(entry)` add up to more.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def get(self, key, valid=None):
+        """Entry for `key`, or None. An entry failing `valid(entry)` is dropped as stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and valid is not None and not valid(entry):
+                self._remove(key)
+                self._stats["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def put(self, key, entry):
+        size = self.sizeof(entry) if self.sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            if size:
+                self._sizes[key] = size
+                self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def discard_many(self, keys):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes if self.sizeof else None,
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "evictions": self._stats["evictions"],
+                "invalidations": self._stats["invalidations"],
+                "hit_rate": (self._stats["hits"] / lookups) if lookups else None
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+# ─────────────────────────────────────────────
+# Search results
+# ─────────────────────────────────────────────
+SEARCH_CACHE_SIZE = 512
+
+search_results = LRUCache(SEARCH_CACHE_SIZE)
+
+def search_key(package, db_meta):
+    """(key, tables) for a search package: its canonical JSON plus the tables it reads."""
+    tables = {t for t in package if not t.startswith("_")}
+    order_by = package.get("_order_by")
+    if isinstance(order_by, str) and "." in order_by:
+        tables.add(order_by.lstrip("-").split(".", 1)[0])
+    tables = tuple(sorted(tables))
+    return (id(db_meta), json.dumps(package, sort_keys=True, default=str)), tables
+
+def _copy_action(action):
+    # values are numbers, None or lists of UUID strings
+    return {k: list(v) if isinstance(v, list) else v for k, v in action.items()}
+
+def cached_search(cursor, key, tables):
+    """(action, errors, usage) cached for `key` if none of `tables` was written since, else None."""
+    if has_pending(cursor):
+        return None
+    stamp = generations(tables)
+    entry = search_results.get(key, valid=lambda entry: entry[0] == stamp)
+    if entry is None:
+        return None
+    _, action, errors, usage = entry
+    return _copy_action(action), list(errors), usage
+
+def store_search(cursor, key, stamp, action, errors, usage):
+    """Cache a search's output, computed after the generations in `stamp` were read."""
+    if has_pending(cursor):
+        return
+    search_results.put(key, (stamp, _copy_action(action), list(errors), usage))
+
+# ─────────────────────────────────────────────
+# Entities
+# ─────────────────────────────────────────────
+# The rows of one UUID in one table, as read/list return them. Entities
+# with no rows are cached too, so a repeated read skips tables the UUID
+# has nothing in.
+ENTITY_CACHE_SIZE = 100000
+ENTITY_CACHE_BYTES = 64 * 1024 * 1024
+
+def _entity_size(entry):
+    fields, rows = entry
+    return 64 + sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in rows)
+
+entities = LRUCache(ENTITY_CACHE_SIZE, max_bytes=ENTITY_CACHE_BYTES, sizeof=_entity_size)
+
+def cached_rows(cursor, spec, uuids):
+    """
+    ({uuid: rows} from the cache, [uuids to fetch], epoch). Pass the epoch
+    to store_rows() with what gets fetched.
+    """
+    epoch = entity_epoch()
+    if has_pending(cursor):
+        return {}, list(uuids), epoch
+
+    found = {}
+    missing = []
+    for uuid in uuids:
+        entry = entities.get((uuid, spec.name), valid=lambda entry: entry[0] == spec.fields)
+        if entry is None:
+            missing.append(uuid)
+        else:
+            found[uuid] = entry[1]
+    return found, missing, epoch
+
+def store_rows(cursor, spec, uuids, rows_by_uuid, epoch):
+    """Cache the rows fetched for `uuids` (none for those absent from `rows_by_uuid`)."""
+    if has_pending(cursor):
+        return
+    # held so no invalidation slips in between the epoch check and the puts
+    with _lock:
+        if _entity_epoch[0] != epoch:
+            return
+        for uuid in uuids:
+            entities.put((uuid, spec.name), (spec.fields, tuple(rows_by_uuid.get(uuid, ()))))
+
+def read_entities(cursor, db_meta, tables, uuids):
+    """
+    {table: {uuid: rows}} for every UUID in every table (empty rows
+    included): cached entities first, the misses in one select_entities() call.
+    """
+    epoch = entity_epoch()
+    found = {}
+    missing = {}
+    for table in tables:
+        found[table], missing[table], _ = cached_rows(cursor, db_meta.get(table), uuids)
+
+    need_tables = [t for t in tables if missing[t]]
+    if need_tables:
+        need_uuids = list(dict.fromkeys(u for t in need_tables for u in missing[t]))
+        fetched = sql.select_entities(cursor, db_meta, need_tables, need_uuids)
+        for table in need_tables:
+            store_rows(cursor, db_meta.get(table), missing[table], fetched[table], epoch)
+            for uuid in missing[table]:
+                found[table][uuid] = fetched[table].get(uuid, ())
+    return found
+
+def stats():
+    return {"search": search_results.stats(), "entities": entities.stats()}
@@ -0,0 +1,144 @@
+# ─────────────────────────────────────────────
+# Compiled schema catalog
+# ─────────────────────────────────────────────
+# Built once from db_meta so tools can validate tables/fields with set and
+# dict lookups and reuse pre-rendered SQL instead of rebuilding it per row.
+
+RESERVED_TABLES = ("Registry", "sqlite_sequence")
+
+class TableSpec:
+    __slots__ = (
+        "name", "fields", "field_set", "uuid_pos", "text_indexes", "delete_row_sql",
+        "_insert_sql", "_update_sql", "_select_in_sql", "_keys_in_sql"
+    )
+
+    def __init__(self, name, fields, text_indexes=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.field_set = frozenset(self.fields)
+        self.uuid_pos = self.fields.index("UUID")
+
+        # kind -> (index table, frozenset of covered fields), see utils/fts.py
+        self.text_indexes = {
+            kind: (info["name"], frozenset(info["fields"]))
+            for kind, info in (text_indexes or {}).items()
+        }
+
+        self.delete_row_sql = f"DELETE FROM {name} WHERE UUID = ? AND IND = ?"
+
+        self._insert_sql = {}
+        self._update_sql = {}
+        self._select_in_sql = {}
+        self._keys_in_sql = {}
+
+    def text_index(self, field, kind="fts"):
+        """Name of the `kind` full-text index covering `field`, or None."""
+        index = self.text_indexes.get(kind)
+        if index and field in index[1]:
+            return index[0]
+        return None
+
+    def missing(self, fields):
+        return [f for f in fields if f not in self.field_set]
+
+    def select_in_sql(self, count):
+        """SELECT of all fields for `count` UUIDs at once, ordered by UUID then IND."""
+        sql = self._select_in_sql.get(count)
+        if sql is None:
+            sql = (
+                f"SELECT {', '.join(self.fields)} FROM {self.name} "
+                f"WHERE UUID IN ({', '.join(['?'] * count)}) ORDER BY UUID, IND"
+            )
+            self._select_in_sql[count] = sql
+        return sql
+
+    def insert_sql(self, fields):
+        """INSERT for UUID, IND plus `fields` (a tuple), cached per field signature."""
+        sql = self._insert_sql.get(fields)
+        if sql is None:
+            field_str = ", ".join(("UUID", "IND") + fields)
+            sql = f"INSERT INTO {self.name} ({field_str}) VALUES ({', '.join(['?'] * (2 + len(fields)))})"
+            self._insert_sql[fields] = sql
+        return sql
+
+    def update_sql(self, fields):
+        """
+        UPDATE of `fields` (a tuple) for one UUID/IND row, cached per field
+        signature. Bind the values, UUID, IND, then the values again: the
+        row is only written when some field actually differs.
+        """
+        sql = self._update_sql.get(fields)
+        if sql is None:
+            set_clause = ", ".join(f"{f} = ?" for f in fields)
+            guard = " OR ".join(f"{f} IS NOT ?" for f in fields)
+            sql = f"UPDATE {self.name} SET {set_clause} WHERE UUID = ? AND IND = ? AND ({guard})"
+            self._update_sql[fields] = sql
+        return sql
+
+    def keys_in_sql(self, count):
+        """(UUID, IND) of the rows matching `count` bound UUID/IND pairs."""
+        sql = self._keys_in_sql.get(count)
+        if sql is None:
+            values = ", ".join(["(?, ?)"] * count)
+            sql = (
+                f"SELECT t.UUID, t.IND FROM (VALUES {values}) AS k "
+                f"JOIN {self.name} AS t ON t.UUID = k.column1 AND t.IND = k.column2"
+            )
+            self._keys_in_sql[count] = sql
+        return sql
+
+class SchemaCatalog:
+    """
+    Drop-in replacement for the old {"tables": [...], "fields": [[...]]} dict.
+
+    `catalog["tables"]` / `catalog["fields"]` still work for older callers;
+    tools should use `table in catalog`, `catalog.get(table)` and the
+    TableSpec attributes instead.
+    """
+
+    def __init__(self, meta):
+        self.tables = tuple(meta["tables"])
+        self.fields = tuple(tuple(cols) for cols in meta["fields"])
+        self.text_indexes = meta.get("text_indexes", {})
+        self.specs = {
+            table: TableSpec(table, cols, self.text_indexes.get(table))
+            for table, cols in zip(self.tables, self.fields)
+        }
+        self.data_tables = tuple(t for t in self.tables if t not in RESERVED_TABLES)
+        self._union_sql = {}
+
+    def __contains__(self, table):
+        return table in self.specs
+
+    def __getitem__(self, key):
+        if key == "tables":
+            return self.tables
+        if key == "fields":
+            return self.fields
+        raise KeyError(key)
+
+    def get(self, table):
+        return self.specs.get(table)
+
+    def union_select_sql(self, tables, count):
+        """
+        One SELECT for every row of `count` UUIDs across `tables` (a tuple),
+        binding the UUIDs once per table. Each row is (table position, UUID,
+        fields...), padded with NULLs to the widest table.
+        """
+        key = (tables, count)
+        sql = self._union_sql.get(key)
+        if sql is None:
+            width = max(len(self.specs[t].fields) for t in tables)
+            marks = ", ".join(["?"] * count)
+            selects = []
+            for position, table in enumerate(tables):
+                fields = self.specs[table].fields
+                columns = ", ".join(fields + ("NULL",) * (width - len(fields)))
+                selects.append(f"SELECT {position}, UUID, {columns} FROM {table} WHERE UUID IN ({marks})")
+            sql = " UNION ALL ".join(selects)
+            self._union_sql[key] = sql
+        return sql
+
+    def is_data_table(self, table):
+        return table in self.specs and table not in RESERVED_TABLES
@@ -1,82 +1,354 @@
 import sqlite3
+import hashlib
 import json
 import os
 import sys
+import queue
+import threading
+import weakref
+from contextlib import contextmanager
+
+from utils import cache, fts, search_plan
+from utils.catalog import SchemaCatalog
+
+# Nothing below touches the settings file or the database at import time;
+# the first get_env() call loads both (see _ensure_initialized).
+
+SETTINGS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../settings/database.json"))
+DB_NAME = "docket.db"
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 30.0
+STATEMENT_CACHE_SIZE = 256   # prepared statements kept per connection (sqlite3 default 128)
 
 # ─────────────────────────────────────────────
-# Load DB config
+# Connection pool
 # ─────────────────────────────────────────────
-SETTINGS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../settings/database.json"))
+class PoolExhausted(RuntimeError):
+    pass
 
-try:
-    with open(SETTINGS_PATH, "r") as f:
-        db_config = json.load(f)
-except Exception as e:
-    print(f"[ERROR] Failed to load database settings: {e}")
-    sys.exit(1)
+class _Held:
+    """A thread's checked-out connection; dropped with the thread's locals."""
+    __slots__ = ("conn", "count", "finalizer", "__weakref__")
 
-DB_NAME = "docket.db"
+    def __init__(self, conn):
+        self.conn = conn
+        self.count = 1
+        self.finalizer = None
+
+class ConnectionPool:
+    """
+    Hands out one SQLite connection per thread.
+
+    A thread that checks out twice gets the same connection back; it only
+    returns to the idle stack once every checkout has been checked in.
+    At most `size` connections are out at any time, further checkouts wait
+    up to `timeout` seconds for a slot. Idle connections are health-checked
+    before reuse and replaced when the check fails. A thread that ends
+    without checking its connection in gives it back when its locals go.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = set()
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, timeout=self.timeout,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        # WAL lets readers on other connections run alongside one writer
+        conn.execute("PRAGMA journal_mode=WAL;")
+        with self._lock:
+            self._opened.add(conn)
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
 
-if DB_NAME not in db_config:
-    print(f"[ERROR] '{DB_NAME}' not found in database.json.")
-    sys.exit(1)
+    @staticmethod
+    def _healthy(conn):
+        try:
+            conn.execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
 
-DB_PATH = db_config[DB_NAME]["path"]
+    def checkout(self):
+        held = getattr(self._local, "held", None)
+        if held:
+            held.count += 1
+            return held.conn
+
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"No connection available within {self.timeout}s (pool size {self.size}).")
+
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._open()
+                    continue
+                if self._healthy(candidate):
+                    conn = candidate
+                else:
+                    self._discard(candidate)
+        except Exception:
+            self._slots.release()
+            raise
+
+        held = _Held(conn)
+        # runs if the thread ends while still holding the connection
+        held.finalizer = weakref.finalize(held, self._return, conn)
+        held.finalizer.atexit = False
+        self._local.held = held
+        return conn
+
+    def checkin(self, conn):
+        held = getattr(self._local, "held", None)
+        if not held or held.conn is not conn:
+            raise ValueError("Connection was not checked out by this thread.")
+
+        held.count -= 1
+        if held.count:
+            return
+        self._local.held = None
+        held.finalizer.detach()
+        self._return(conn)
+
+    def _return(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            cache.settle(conn.cursor())
+        except sqlite3.Error:
+            pass
+
+        if self._closed or not self._healthy(conn):
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def owns(self, conn):
+        with self._lock:
+            return conn in self._opened
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            opened = list(self._opened)
+            self._opened.clear()
+        for conn in opened:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
 
 # ─────────────────────────────────────────────
-# Connect to the database
+# Load DB config
 # ─────────────────────────────────────────────
-try:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    cursor = conn.cursor()
-except Exception as e:
-    print(f"[ERROR] Failed to connect to database '{DB_NAME}': {e}")
-    sys.exit(1)
+def load_db_config():
+    try:
+        with open(SETTINGS_PATH, "r") as f:
+            db_config = json.load(f)
+    except Exception as e:
+        print(f"[ERROR] Failed to load database settings: {e}")
+        sys.exit(1)
+
+    if DB_NAME not in db_config:
+        print(f"[ERROR] '{DB_NAME}' not found in database.json.")
+        sys.exit(1)
+
+    return db_config
 
 # ─────────────────────────────────────────────
 # Schema validation and metadata extraction
 # ─────────────────────────────────────────────
-def validate_schema_and_extract_meta():
+def validate_schema_and_extract_meta(cursor):
     meta = { "tables": [], "fields": [] }
 
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+    rows = cursor.fetchall()
+
+    # Virtual tables (FTS indexes) and their shadow tables are not data tables
+    virtual = [name for name, sql in rows if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")]
+    tables = [
+        name for name, _ in rows
+        if name not in virtual and not any(name.startswith(f"{v}_") for v in virtual)
+    ]
+
+    if "Registry" not in tables:
+        raise ValueError("Missing required 'Registry' table.")
+
+    for table in tables:
+        # SQLite's own tables: sqlite_sequence, sqlite_stat1 (from ANALYZE), ...
+        if table.startswith("sqlite_"):
+            continue
+
+        cursor.execute(f"PRAGMA table_info({table});")
+        cols = [row[1] for row in cursor.fetchall()]
+
+        meta["tables"].append(table)
+        meta["fields"].append(cols)
+
+        if table == "Registry":
+            if cols != ["UUID"]:
+                raise ValueError("'Registry' table must only contain 'UUID'")
+        else:
+            if "UUID" not in cols or "IND" not in cols:
+                raise ValueError(f"Table '{table}' missing required fields 'UUID' and/or 'IND'.")
+
+    meta["text_indexes"] = fts.find_indexes(cursor, meta["tables"])
+
+    return meta
+
+# ─────────────────────────────────────────────
+# Schema metadata cache
+# ─────────────────────────────────────────────
+# db_meta is stored beside the database and keyed by PRAGMA schema_version,
+# which SQLite bumps on every schema change, plus a hash of the schema SQL:
+# the version only counts changes, so a recreated database can reach the
+# same number with different tables. A matching key means the schema was
+# already validated and introspection can be skipped.
+def meta_cache_path(db_path):
+    return f"{db_path}-meta.json"
+
+def schema_fingerprint(cursor):
+    cursor.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name;")
+    return hashlib.sha1(json.dumps(cursor.fetchall()).encode("utf-8")).hexdigest()
+
+def load_meta(cursor, db_path):
+    schema_version = cursor.execute("PRAGMA schema_version;").fetchone()[0]
+    fingerprint = schema_fingerprint(cursor)
+    cache_path = meta_cache_path(db_path)
+
     try:
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall()]
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("schema_version") == schema_version and cached.get("fingerprint") == fingerprint:
+            return cached["meta"]
+    except (OSError, ValueError, KeyError):
+        pass
 
-        if "Registry" not in tables:
-            raise ValueError("Missing required 'Registry' table.")
+    meta = validate_schema_and_extract_meta(cursor)
 
-        for table in tables:
-            if table == "sqlite_sequence":
-                continue
+    try:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"schema_version": schema_version, "fingerprint": fingerprint, "meta": meta}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
 
-            cursor.execute(f"PRAGMA table_info({table});")
-            cols = [row[1] for row in cursor.fetchall()]
+    return meta
 
-            meta["tables"].append(table)
-            meta["fields"].append(cols)
+# ─────────────────────────────────────────────
+# Lazy initialization
+# ─────────────────────────────────────────────
+# Filled in by the first get_env(); module attributes of the same names
+# (pool, db_meta, DB_PATH, db_config) resolve through __getattr__ below.
+_state = {}
+_init_lock = threading.Lock()
+_env = threading.local()
 
-            if table == "Registry":
-                if cols != ["UUID"]:
-                    raise ValueError("'Registry' table must only contain 'UUID'")
-            else:
-                if "UUID" not in cols or "IND" not in cols:
-                    raise ValueError(f"Table '{table}' missing required fields 'UUID' and/or 'IND'.")
+def _ensure_initialized():
+    if _state:
+        return
 
-        return meta
+    with _init_lock:
+        if _state:
+            return
 
-    except Exception as e:
-        print(f"[ERROR] Schema validation failed: {e}")
-        conn.close()
-        sys.exit(1)
+        db_config = load_db_config()
+        settings = db_config[DB_NAME]
+        db_path = settings["path"]
+
+        try:
+            pool = ConnectionPool(
+                db_path,
+                size=int(settings.get("pool_size", DEFAULT_POOL_SIZE)),
+                timeout=float(settings.get("pool_timeout", DEFAULT_POOL_TIMEOUT))
+            )
+            conn = pool.checkout()
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to database '{DB_NAME}': {e}")
+            sys.exit(1)
+
+        try:
+            db_meta = SchemaCatalog(load_meta(conn.cursor(), db_path))
+        except Exception as e:
+            print(f"[ERROR] Schema validation failed: {e}")
+            pool.close()
+            sys.exit(1)
+        pool.checkin(conn)
+
+        _state.update(db_config=db_config, DB_PATH=db_path, pool=pool, db_meta=db_meta)
 
-db_meta = validate_schema_and_extract_meta()
+def _thread_env():
+    _ensure_initialized()
+    if getattr(_env, "conn", None) is None:
+        _env.conn = _state["pool"].checkout()
+        _env.cursor = _env.conn.cursor()
+    return _env.conn, _env.cursor
+
+def release_env():
+    conn = getattr(_env, "conn", None)
+    if conn is not None:
+        _env.conn = _env.cursor = None
+        _state["pool"].checkin(conn)
+
+def __getattr__(name):
+    if name in ("db_config", "DB_PATH", "pool", "db_meta"):
+        _ensure_initialized()
+        return _state[name]
+    # Older scripts import conn/cursor straight from this module
+    if name in ("conn", "cursor"):
+        conn, cursor = _thread_env()
+        return conn if name == "conn" else cursor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ─────────────────────────────────────────────
 # Shared access function
 # ─────────────────────────────────────────────
 def get_env():
-    return conn, cursor, db_meta
+    """Connection and cursor owned by the calling thread, plus the shared SchemaCatalog."""
+    conn, cursor = _thread_env()
+    return conn, cursor, _state["db_meta"]
+
+def refresh_meta():
+    """Re-read db_meta after this process changed the schema (e.g. utils.fts.create_index)."""
+    _ensure_initialized()
+    with _state["pool"].connection() as conn:
+        _state["db_meta"] = SchemaCatalog(load_meta(conn.cursor(), _state["DB_PATH"]))
+    # compiled searches reference the old catalog's tables and indexes
+    search_plan.clear_plans()
+    return _state["db_meta"]
 
 def close_connection():
-    conn.close()
+    if _state:
+        _state["pool"].close()
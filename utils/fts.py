@@ -0,0 +1,110 @@
+# ─────────────────────────────────────────────
+# Full-text shadow indexes (SQLite FTS5)
+# ─────────────────────────────────────────────
+# Each index is an external-content FTS5 table named <table><suffix> over
+# some text fields of one data table:
+#   fts      → word tokens, for free text (Notes)
+#   trigram  → every 3-character window, for substrings of names, emails
+#              and phone numbers ("ali", "602-")
+# Triggers on the data table keep every index in sync with each insert,
+# delete and update, whichever tool makes them.
+#
+# FTS rows are tied to the data table's rowid. VACUUM may renumber rowids
+# of tables without an INTEGER PRIMARY KEY, so run rebuild_index() after one.
+
+KINDS = {
+    "fts": {"suffix": "_fts", "tokenize": "unicode61 remove_diacritics 2"},
+    "trigram": {"suffix": "_tri", "tokenize": "trigram"},
+}
+
+# Fields operators search by partial string
+TRIGRAM_FIELDS = {
+    "Contacts": ["first_name", "middle_name", "last_name", "full_name"],
+    "Email_Addresses": ["email_address"],
+    "Phone_Numbers": ["phone_number"],
+}
+
+def index_name(table, kind="fts"):
+    return f"{table}{KINDS[kind]['suffix']}"
+
+def create_index(cursor, db_meta, table, fields, kind="fts"):
+    """Create (or replace) the `kind` index on `fields` of `table` and fill it."""
+    spec = db_meta.get(table)
+    if spec is None or not db_meta.is_data_table(table):
+        raise ValueError(f"Table '{table}' does not exist.")
+    missing = spec.missing(fields)
+    if missing:
+        raise ValueError(f"Missing fields in '{table}': {missing}")
+
+    drop_index(cursor, table, kind)
+
+    name = index_name(table, kind)
+    cols = ", ".join(fields)
+    new_cols = ", ".join(f"new.{f}" for f in fields)
+    old_cols = ", ".join(f"old.{f}" for f in fields)
+    tokenize = KINDS[kind]["tokenize"]
+
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE {name} USING fts5(
+            {cols}, content='{table}', content_rowid='rowid', tokenize='{tokenize}'
+        );
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER {name}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {name} (rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END;
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER {name}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {name} ({name}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+        END;
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER {name}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {name} ({name}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+            INSERT INTO {name} (rowid, {cols}) VALUES (new.rowid, {new_cols});
+        END;
+    """)
+    rebuild_index(cursor, table, kind)
+
+def create_trigram_indexes(cursor, db_meta, fields_by_table=None):
+    """Create the trigram indexes in TRIGRAM_FIELDS (or `fields_by_table`) for tables that exist."""
+    for table, fields in (fields_by_table or TRIGRAM_FIELDS).items():
+        if db_meta.is_data_table(table):
+            create_index(cursor, db_meta, table, fields, kind="trigram")
+
+def drop_index(cursor, table, kind="fts"):
+    name = index_name(table, kind)
+    for trigger in ("ai", "ad", "au"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}_{trigger};")
+    cursor.execute(f"DROP TABLE IF EXISTS {name};")
+
+def rebuild_index(cursor, table, kind="fts"):
+    name = index_name(table, kind)
+    cursor.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild');")
+
+def find_indexes(cursor, tables):
+    """
+    {table: {kind: {"name": ..., "fields": [...]}}} for the indexes present,
+    read from sqlite_master. Used when building db_meta.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE 'CREATE VIRTUAL TABLE%';")
+    virtual = {row[0] for row in cursor.fetchall()}
+
+    found = {}
+    for table in tables:
+        for kind in KINDS:
+            name = index_name(table, kind)
+            if name in virtual:
+                cursor.execute(f"PRAGMA table_info({name});")
+                fields = [row[1] for row in cursor.fetchall()]
+                found.setdefault(table, {})[kind] = {"name": name, "fields": fields}
+    return found
+
+def phrase(term):
+    """FTS5 phrase for `term`, prefix-matching its last token."""
+    return '"' + str(term).replace('"', '""') + '"*'
+
+def substring(term):
+    """Trigram-index phrase matching `term` anywhere in the field."""
+    return '"' + str(term).replace('"', '""') + '"'
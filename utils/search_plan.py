@@ -0,0 +1,426 @@
+import threading
+from collections import OrderedDict
+
+from utils import fts
+
+# ─────────────────────────────────────────────
+# Search compiler
+# ─────────────────────────────────────────────
+# A search package is compiled once per "shape" into a SearchPlan: the SQL
+# text with ? placeholders plus a list of where each parameter comes from
+# in the package. Two packages with the same tables, fields, groups,
+# operators and arity (and the same index routing for their terms) share a
+# plan, so repeated searches only pull their values out of the package and
+# hit sqlite3's statement cache with identical SQL.
+
+# "_mode" option: "like" scans with LIKE '%term%', "fts" routes contains
+# rules through the field's FTS5 index when it has one (utils/fts.py).
+# In either mode a contains rule of 3+ characters on a field with a trigram
+# index is answered from that index, which matches the same substrings.
+SEARCH_MODES = ("like", "fts")
+TRIGRAM_MIN_LENGTH = 3
+
+GROUPS = ("and", "or", "nand", "nor")
+PLAN_CACHE_SIZE = 256
+
+# ─────────────────────────────────────────────
+# Rules
+# ─────────────────────────────────────────────
+# A rule's signature is everything about it that changes the SQL: the
+# operator plus its route (which index answers a contains, how many values
+# an in carries, ...). Its value only changes the parameters.
+#
+# Everything but contains compiles to plain comparisons on the column, so
+# SQLite can answer it from an index on that field:
+#   equals / gt / gte / lt / lte   → field = ? / > / >= / < / <=
+#   between [low, high]            → field BETWEEN ? AND ?
+#   in [v1, v2, ...]               → field IN (?, ?, ...)
+#   starts_with                    → field >= prefix AND field < next prefix
+#   is_null true / false           → field IS NULL / IS NOT NULL
+COMPARISONS = {"equals": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+OPERATORS = tuple(COMPARISONS) + ("contains", "starts_with", "between", "in", "is_null")
+
+def _fts_param(field, value):
+    return [f"{field} : {fts.phrase(value)}"]
+
+def _trigram_param(field, value):
+    return [f"{field} : {fts.substring(value)}"]
+
+def _like_param(field, value):
+    return [f"%{value}%"]
+
+def _value_param(field, value):
+    return [value]
+
+def _list_param(field, value):
+    return list(value)
+
+def _prefix_param(field, value):
+    return [str(value), prefix_bound(str(value))]
+
+def _substr_param(field, value):
+    return [str(value), str(value)]
+
+def prefix_bound(prefix):
+    """
+    Smallest string above every string starting with `prefix` (BINARY
+    collation), or None when the last character cannot be incremented.
+    """
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000   # surrogates cannot be stored
+    if code > 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(code)
+
+def rule_signature(spec, field, rule, mode):
+    """(op, route) for `rule`; unknown operators come back as ("unknown", name)."""
+    op = next((name for name in OPERATORS if name in rule), None)
+    if op is None:
+        return ("unknown", next(iter(rule), None))
+    value = rule[op]
+
+    if op in COMPARISONS:
+        return (op, None)
+
+    if op == "contains":
+        term = str(value)
+
+        # FTS matches whole tokens, so terms without any word characters stay on LIKE
+        if mode == "fts" and spec.text_index(field) and any(ch.isalnum() for ch in term):
+            return ("contains", "fts")
+
+        # Terms carrying LIKE wildcards keep their LIKE meaning
+        if (spec.text_index(field, "trigram") and len(term) >= TRIGRAM_MIN_LENGTH
+                and not any(ch in term for ch in "%_")):
+            return ("contains", "trigram")
+
+        return ("contains", "like")
+
+    if op == "starts_with":
+        prefix = str(value)
+        if not prefix:
+            return ("starts_with", "any")
+        return ("starts_with", "range" if prefix_bound(prefix) is not None else "substr")
+
+    if op == "between":
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise ValueError(f"'between' on field '{field}' needs [low, high].")
+        return ("between", None)
+
+    if op == "in":
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"'in' on field '{field}' needs a list of values.")
+        return ("in", len(value))
+
+    # is_null
+    return ("is_null", bool(value))
+
+def rule_sql(spec, field, signature, negated=False):
+    """
+    SQL for one rule plus a converter from its value to the bound
+    parameters. `negated` rules (nand/nor groups) must stay NULL for a NULL
+    field, like the LIKE they stand in for, so NOT () never matches it.
+    """
+    op, route = signature
+
+    if op in COMPARISONS:
+        return f"{field} {COMPARISONS[op]} ?", _value_param
+
+    if op == "contains":
+        if route in ("fts", "trigram"):
+            index = spec.text_index(field, route)
+            convert = _fts_param if route == "fts" else _trigram_param
+            clause = f"rowid IN (SELECT rowid FROM {index} WHERE {index} MATCH ?)"
+            if negated:
+                clause = f"CASE WHEN {field} IS NULL THEN NULL ELSE {clause} END"
+            return clause, convert
+        return f"{field} LIKE ?", _like_param
+
+    if op == "starts_with":
+        if route == "any":
+            return f"{field} IS NOT NULL", None
+        if route == "substr":
+            return f"substr({field}, 1, length(?)) = ?", _substr_param
+        return f"({field} >= ? AND {field} < ?)", _prefix_param
+
+    if op == "between":
+        return f"{field} BETWEEN ? AND ?", _list_param
+
+    if op == "in":
+        if not route:
+            return "0", None   # an empty list matches nothing
+        return f"{field} IN ({', '.join(['?'] * route)})", _list_param
+
+    # is_null
+    return f"{field} IS NULL" if route else f"{field} IS NOT NULL", None
+
+# ─────────────────────────────────────────────
+# Shapes
+# ─────────────────────────────────────────────
+# Paging options, bound as parameters after the rules:
+#   "_limit": n        at most n matches
+#   "_offset": n       skip the first n matches
+#   "_cursor": uuid    keyset paging, matches after this UUID (UUID order only)
+#   "_order_by"        "UUID" (default once paging is used), "Table.field",
+#                      either prefixed with "-" for descending
+#   "_count_only"      return the number of matches instead of the UUIDs;
+#                      paging options are ignored
+PAGING_OPTIONS = ("_cursor", "_limit", "_offset")
+
+def search_options(package, db_meta):
+    """(order, descending, count_only, paging keys present) for `package`, validated."""
+    for key in ("_limit", "_offset"):
+        value = package.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            raise ValueError(f"'{key}' must be a non-negative integer.")
+
+    if package.get("_count_only"):
+        return (None, False, True, ())
+
+    paging = tuple(key for key in PAGING_OPTIONS if package.get(key) is not None)
+
+    order_by = package.get("_order_by")
+    if order_by is None:
+        return ("UUID" if paging else None, False, False, paging)
+
+    order = str(order_by)
+    descending = order.startswith("-")
+    order = order.lstrip("-")
+    if order != "UUID":
+        table, _, field = order.partition(".")
+        if not db_meta.is_data_table(table) or field not in db_meta.get(table).field_set:
+            raise ValueError(f"Cannot order by '{order}': expected 'UUID' or 'Table.field'.")
+        if "_cursor" in paging:
+            raise ValueError("'_cursor' pages in UUID order; use '_offset' with '_order_by' on a field.")
+        order = (table, field)
+    return (order, descending, False, paging)
+
+def package_shape(package, db_meta):
+    """Hashable key covering everything in `package` that affects the compiled SQL."""
+    mode = package.get("_mode", "like")
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}'.")
+    options = search_options(package, db_meta)
+
+    tables = []
+    for table, fields in package.items():
+        if table.startswith("_"):
+            continue
+
+        spec = db_meta.get(table)
+        if spec is None:
+            tables.append((table, None))
+            continue
+
+        field_shapes = []
+        for field, logic in fields.items():
+            if field not in spec.field_set:
+                field_shapes.append((field, None))
+                continue
+            field_shapes.append((field, tuple(
+                tuple(rule_signature(spec, field, rule, mode) for rule in logic.get(group, []))
+                for group in GROUPS
+            )))
+        tables.append((table, tuple(field_shapes)))
+
+    return (mode, tuple(tables), options)
+
+# ─────────────────────────────────────────────
+# Plans
+# ─────────────────────────────────────────────
+class SearchPlan:
+    """
+    Compiled search: `sql` (None when no rule applies), the `errors` every
+    package of this shape produces, per-table advisor `usage`, and the
+    parameter sources as (table, field, group, position, op, convert);
+    `convert` turns a rule's value into its list of parameters. The paging
+    options in `options` are bound after the rules. `count_only` plans
+    return one COUNT row, `keyset` plans can hand out a next cursor.
+    """
+
+    __slots__ = ("sql", "sources", "options", "errors", "usage", "count_only", "keyset")
+
+    def __init__(self, sql, sources, errors, usage, options=(), count_only=False, keyset=False):
+        self.sql = sql
+        self.sources = sources
+        self.options = options
+        self.errors = errors
+        self.usage = usage
+        self.count_only = count_only
+        self.keyset = keyset
+
+    def parameters(self, package):
+        values = []
+        for table, field, group, position, op, convert in self.sources:
+            values.extend(convert(field, package[table][field][group][position][op]))
+        values.extend(package[key] for key in self.options)
+        return values
+
+# ─────────────────────────────────────────────
+# Cross-table intersection
+# ─────────────────────────────────────────────
+# All tables of a search become one statement: the most selective table
+# drives and every other table filters it through UUID IN (subquery), so
+# only the final matches leave SQLite. The order is fixed when a shape is
+# compiled; plans are dropped with the cache when db_meta is reloaded.
+DEFAULT_ROWS = 1000000
+RULE_SELECTIVITY = {
+    "equals": 0.05, "in": 0.1, "starts_with": 0.1, "between": 0.1,
+    "gt": 0.3, "gte": 0.3, "lt": 0.3, "lte": 0.3, "contains": 0.3, "is_null": 0.3
+}
+NEGATED_SELECTIVITY = 0.9
+
+def table_rows(cursor):
+    """Row estimates per table from sqlite_stat1 (written by ANALYZE), if present."""
+    try:
+        cursor.execute("SELECT tbl, stat FROM sqlite_stat1;")
+    except Exception:
+        return {}
+    rows = {}
+    for tbl, stat in cursor.fetchall():
+        try:
+            rows[tbl] = max(rows.get(tbl, 0), int(str(stat).split()[0]))
+        except ValueError:
+            pass
+    return rows
+
+def estimate(rows, usage):
+    by_field = {}
+    for field, group, op in usage:
+        by_field.setdefault(field, []).append((group, RULE_SELECTIVITY.get(op, 0.5)))
+
+    estimate = rows
+    for rules in by_field.values():
+        factor = 1.0
+        either = [s for g, s in rules if g == "or"]
+        for group, selectivity in rules:
+            if group == "and":
+                factor *= selectivity
+            elif group in ("nand", "nor"):
+                factor *= NEGATED_SELECTIVITY
+        if either:
+            factor *= min(1.0, sum(either))
+        estimate *= factor
+    return estimate
+
+def compile_plan(shape, db_meta, cursor):
+    mode, tables, (order, descending, count_only, paging) = shape
+    errors = []
+    compiled = []   # (table, where, sources, usage)
+
+    for table, field_shapes in tables:
+        if field_shapes is None:
+            errors.append(f"Table '{table}' does not exist.")
+            continue
+
+        spec = db_meta.get(table)
+        where_clauses = []
+        sources = []
+        usage = []
+
+        for field, groups in field_shapes:
+            if groups is None:
+                errors.append(f"Field '{field}' does not exist in table '{table}'.")
+                continue
+
+            field_condition_parts = []
+            for group, signatures in zip(GROUPS, groups):
+                clauses = []
+                for position, signature in enumerate(signatures):
+                    if signature[0] == "unknown":
+                        errors.append(f"Unknown operator '{signature[1]}' on field '{field}' in table '{table}'.")
+                        continue
+                    clause, convert = rule_sql(spec, field, signature, group in ("nand", "nor"))
+                    clauses.append(clause)
+                    if convert:
+                        sources.append((table, field, group, position, signature[0], convert))
+                    usage.append((field, group, signature[0]))
+                if not clauses:
+                    continue
+
+                joiner = " AND " if group in ("and", "nand") else " OR "
+                negate = "NOT " if group in ("nand", "nor") else ""
+                field_condition_parts.append(f"{negate}({joiner.join(clauses)})")
+
+            if field_condition_parts:
+                where_clauses.append("(" + " OR ".join(field_condition_parts) + ")")
+
+        if where_clauses:
+            compiled.append((table, " AND ".join(where_clauses), sources, usage))
+
+    if not compiled:
+        return SearchPlan(None, [], errors, [], count_only=count_only)
+
+    if len(compiled) > 1:
+        rows = table_rows(cursor)
+        compiled.sort(key=lambda t: estimate(rows.get(t[0], DEFAULT_ROWS), t[3]))
+
+    (table, where, sources, _), others = compiled[0], compiled[1:]
+    sql = f"SELECT DISTINCT UUID FROM {table} WHERE {where}"
+    sources = list(sources)
+    for other_table, other_where, other_sources, _ in others:
+        sql += f" AND UUID IN (SELECT UUID FROM {other_table} WHERE {other_where})"
+        sources.extend(other_sources)
+
+    usage = [(t, table_usage) for t, _, _, table_usage in compiled]
+    if count_only:
+        return SearchPlan(f"SELECT COUNT(*) FROM ({sql})", sources, errors, usage, count_only=True)
+
+    direction = " DESC" if descending else ""
+    if "_cursor" in paging:
+        sql += " AND UUID < ?" if descending else " AND UUID > ?"
+
+    if order == "UUID":
+        # DISTINCT UUID in UUID order walks the driving table's UUID index and stops at the limit
+        sql += f" ORDER BY UUID{direction}"
+    elif order:
+        order_table, order_field = order
+        pick = "MAX" if descending else "MIN"
+        sql = (
+            f"SELECT m.UUID FROM ({sql}) AS m ORDER BY "
+            f"(SELECT {pick}({order_field}) FROM {order_table} WHERE {order_table}.UUID = m.UUID){direction}, "
+            f"m.UUID{direction}"
+        )
+
+    if "_limit" in paging:
+        sql += " LIMIT ?"
+    if "_offset" in paging:
+        sql += " OFFSET ?" if "_limit" in paging else " LIMIT -1 OFFSET ?"
+
+    return SearchPlan(sql, sources, errors, usage, options=paging, keyset=(order == "UUID"))
+
+# ─────────────────────────────────────────────
+# Plan cache
+# ─────────────────────────────────────────────
+_lock = threading.Lock()
+_plans = OrderedDict()   # (id(db_meta), shape) -> SearchPlan, least recently used first
+_stats = {"hits": 0, "misses": 0}
+
+def plan_for(package, db_meta, cursor):
+    """Cached SearchPlan for the shape of `package`, compiling it on a miss."""
+    key = (id(db_meta), package_shape(package, db_meta))
+
+    with _lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            _stats["hits"] += 1
+            return plan
+        _stats["misses"] += 1
+
+    plan = compile_plan(key[1], db_meta, cursor)
+
+    with _lock:
+        _plans[key] = plan
+        while len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
+
+def clear_plans():
+    with _lock:
+        _plans.clear()
+
+def plan_stats():
+    with _lock:
+        return {"plans": len(_plans), **_stats}
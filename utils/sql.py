@@ -0,0 +1,107 @@
+from operator import itemgetter
+
+# ─────────────────────────────────────────────
+# Shared SQL helpers for the tools
+# ─────────────────────────────────────────────
+
+CHUNK_SIZE = 500       # rows per executemany() call
+MAX_VARIABLES = 999    # SQLite's historical bound-parameter limit, safe on every build
+
+def chunks(seq, size=CHUNK_SIZE):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+def placeholders(count):
+    return ", ".join(["?"] * count)
+
+BINDABLE = (str, int, float, bytes, type(None))
+
+def row_error(fields, values):
+    """Why `values` cannot be written to `fields` as one row, or None."""
+    if not isinstance(values, (list, tuple)):
+        return f"expected a list of values, got {type(values).__name__}"
+    if len(values) != len(fields):
+        return f"{len(values)} values for {len(fields)} fields"
+    for field, value in zip(fields, values):
+        if not isinstance(value, BINDABLE):
+            return f"unsupported value for '{field}': {type(value).__name__}"
+    return None
+
+def executemany_chunked(cursor, sql, rows, tags, on_error, size=CHUNK_SIZE):
+    """
+    Run `sql` for every row in `rows`, `size` rows per executemany() call.
+
+    Each chunk runs inside a savepoint. If a chunk fails it is rolled back
+    and replayed row by row so `on_error(tag, exc)` is told exactly which
+    row(s) failed; `tags` runs parallel to `rows`. Returns the number of
+    rows written (for UPDATE/DELETE, the rows that matched).
+    """
+    written = 0
+    for start in range(0, len(rows), size):
+        chunk = rows[start:start + size]
+        cursor.execute("SAVEPOINT chunk;")
+        try:
+            cursor.executemany(sql, chunk)
+            # summed over the whole executemany() call
+            changed = cursor.rowcount
+        except Exception:
+            cursor.execute("ROLLBACK TO chunk;")
+            cursor.execute("RELEASE chunk;")
+            for row, tag in zip(chunk, tags[start:start + size]):
+                try:
+                    cursor.execute(sql, row)
+                    written += cursor.rowcount
+                except Exception as e:
+                    on_error(tag, e)
+        else:
+            cursor.execute("RELEASE chunk;")
+            written += changed
+    return written
+
+def stage_uuids(cursor, uuids, name="_staged_uuids"):
+    """Load `uuids` into a connection-private temp table so statements can join on it."""
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} (UUID TEXT PRIMARY KEY);")
+    cursor.execute(f"DELETE FROM temp.{name};")
+    cursor.executemany(f"INSERT OR IGNORE INTO temp.{name} (UUID) VALUES (?);", ((u,) for u in uuids))
+    return f"temp.{name}"
+
+# A UNION ALL across tables saves the per-statement overhead, which only
+# dominates for a single UUID; for more, one indexed IN query per table
+# (already in UUID, IND order) is faster.
+UNION_MAX_UUIDS = 1
+
+def select_entities(cursor, db_meta, tables, uuids):
+    """
+    {table: {uuid: [rows]}} for `uuids` across `tables`, rows as tuples of
+    the table's fields in IND order. Up to UNION_MAX_UUIDS UUIDs are read
+    in one statement (SchemaCatalog.union_select_sql), more with one query
+    per table per MAX_VARIABLES UUIDs.
+    """
+    tables = tuple(tables)
+    uuids = list(uuids)
+    found = {table: {} for table in tables}
+    if not tables or not uuids:
+        return found
+
+    specs = [db_meta.get(t) for t in tables]
+
+    if len(uuids) > UNION_MAX_UUIDS:
+        for spec, by_uuid in zip(specs, found.values()):
+            for chunk in chunks(uuids, MAX_VARIABLES):
+                cursor.execute(spec.select_in_sql(len(chunk)), chunk)
+                for row in cursor.fetchall():
+                    by_uuid.setdefault(row[spec.uuid_pos], []).append(row)
+        return found
+
+    cursor.execute(db_meta.union_select_sql(tables, len(uuids)), uuids * len(tables))
+    for row in cursor.fetchall():
+        position = row[0]
+        found[tables[position]].setdefault(row[1], []).append(row[2:2 + len(specs[position].fields)])
+
+    # UNION ALL does not promise an order; put each UUID's rows back in IND order
+    for spec, by_uuid in zip(specs, found.values()):
+        ind = itemgetter(spec.fields.index("IND"))
+        for rows in by_uuid.values():
+            if len(rows) > 1:
+                rows.sort(key=ind)
+    return found
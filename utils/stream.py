@@ -0,0 +1,170 @@
+import argparse
+import json
+import sys
+
+from utils import batch
+
+# ─────────────────────────────────────────────
+# Streaming JSONL ingestion
+# ─────────────────────────────────────────────
+# Replays a file of master packages, one JSON object per line, without
+# loading the file: each line is parsed and run through handle_batch
+# before the next line is read.
+#
+# handle_batch commits per package when it runs on its own. Here every
+# `commit_every` packages share one outer transaction, so they commit
+# together; each package still rolls back on its own (atomic=True) or per
+# tool, exactly as handle_batch does. An interval of read-only packages
+# takes no write lock and is committed early when a package that writes
+# comes up. Result lines are held until their
+# interval commits and written right after it, so every line in the output
+# is durable; memory grows with `commit_every`, not with the file.
+#
+# With per_result=True (--per-result) a package's tool outputs are written
+# as iter_batch yields them, one line each, so no package result is ever
+# held whole. Those lines are written before the commit: a package is only
+# done once its status line, held like the others, appears.
+#
+#   python -m utils.stream intake.jsonl -o results.jsonl --commit-every 500
+#   cat intake.jsonl | python -m utils.stream - > results.jsonl
+
+DEFAULT_COMMIT_EVERY = 100
+
+def default_handlers():
+    """Every tool in tools/, keyed by the name packages use."""
+    from tools import create, update, delete, read, search, list as list_tool, index
+    return {
+        "create": create.handle,
+        "update": update.handle,
+        "delete": delete.handle,
+        "read": read.handle,
+        "search": search.handle,
+        "list": list_tool.handle,
+        "index": index.handle
+    }
+
+def _write(out, record):
+    out.write(json.dumps(record, default=str) + "\n")
+    out.flush()
+
+def _run_per_result(number, package, out, conn, cursor, db_meta, tool_handlers, atomic, parallel, max_workers):
+    """Write each tool output of `package` as it is ready; return its summary."""
+    for key, output in batch.iter_batch(package, conn, cursor, db_meta, tool_handlers,
+                                        atomic=atomic, parallel=parallel, max_workers=max_workers):
+        if key is None:
+            return output
+        _write(out, {"line": number, "batch": key[0], "process": key[1], "tool": key[2], **output})
+
+def stream_batches(lines, out, conn, cursor, db_meta, tool_handlers, commit_every=DEFAULT_COMMIT_EVERY,
+                   atomic=False, parallel=False, max_workers=None, per_result=False):
+    """
+    Run each master package in `lines` (an iterable of JSON strings, e.g. an
+    open file) and write {"line": n, "status", "errors", "action"} per
+    package to `out`. Blank lines are skipped; a line that is not a JSON
+    object gets an error result. Commits every `commit_every` packages and
+    at the end, writing each interval's lines once it has committed.
+    Returns {"lines", "success", "partial", "error"} counts.
+
+    With `per_result=True` every tool output is written first as
+    {"line", "batch", "process", "tool", "status", "errors", "action"} and
+    the package line carries only "status" and "errors".
+    """
+    commit_every = max(1, int(commit_every))
+    counts = {"lines": 0, "success": 0, "partial": 0, "error": 0}
+    open_packages = 0
+    outermost = False
+    writing = False   # whether the open interval holds the write lock
+    held = []   # result lines of the open interval, written once it commits
+
+    def flush():
+        for record in held:
+            _write(out, record)
+        held.clear()
+
+    try:
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            counts["lines"] += 1
+
+            try:
+                package = json.loads(line)
+                if not isinstance(package, dict):
+                    raise ValueError("a package must be a JSON object")
+            except ValueError as e:
+                result = {"status": "error", "errors": [f"line {number}: {e}"], "action": {}}
+            else:
+                # a read-only interval cannot take the write lock later, so
+                # commit it before the first package that writes
+                if open_packages and not writing and batch.has_writes(package):
+                    batch._close_scope(cursor, "stream", outermost)
+                    open_packages = 0
+                    flush()
+                if open_packages == 0:
+                    writing = batch.has_writes(package)
+                    outermost = batch._open_scope(cursor, "stream", writing)
+                try:
+                    if per_result:
+                        summary = _run_per_result(number, package, out, conn, cursor, db_meta, tool_handlers,
+                                                  atomic, parallel, max_workers)
+                        result = {"status": summary["status"], "errors": summary["errors"]}
+                    else:
+                        result = batch.handle_batch(package, conn, cursor, db_meta, tool_handlers,
+                                                    atomic=atomic, parallel=parallel, max_workers=max_workers)
+                except Exception as e:
+                    # the package was already rolled back
+                    result = {"status": "error", "errors": [f"batch failed: {e}"], "action": {}}
+                open_packages += 1
+
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            held.append({"line": number, **result})
+            if open_packages >= commit_every:
+                batch._close_scope(cursor, "stream", outermost)
+                open_packages = 0
+            if not open_packages:
+                # committed, or nothing uncommitted ahead of an unparsable line
+                flush()
+    except BaseException:
+        # the held lines were never committed, so they are dropped
+        if open_packages:
+            batch._abort_scope(cursor, "stream", outermost)
+        raise
+
+    if open_packages:
+        batch._close_scope(cursor, "stream", outermost)
+        flush()
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run master packages from a JSONL file, one per line.")
+    parser.add_argument("input", help="JSONL file of master packages, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="where to write result lines (default: stdout)")
+    parser.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY,
+                        help=f"packages per commit; result lines are written after each commit (default: {DEFAULT_COMMIT_EVERY})")
+    parser.add_argument("--atomic", action="store_true", help="roll a package back entirely on any error")
+    parser.add_argument("--parallel", action="store_true", help="run read-only tools concurrently")
+    parser.add_argument("--per-result", action="store_true", help="write each tool output as its own line")
+    args = parser.parse_args(argv)
+
+    from utils import connect
+    conn, cursor, db_meta = connect.get_env()
+
+    src = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        counts = stream_batches(src, dst, conn, cursor, db_meta, default_handlers(),
+                                commit_every=args.commit_every, atomic=args.atomic, parallel=args.parallel,
+                                per_result=args.per_result)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+        connect.release_env()
+
+    print(json.dumps(counts), file=sys.stderr)
+    return 0 if counts["error"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())